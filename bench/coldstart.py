@@ -0,0 +1,120 @@
+"""Measure cold-start cost of the Lambda handlers.
+
+Each handler is imported and invoked in a fresh interpreter, as Lambda
+would on a cold start, and the import time and first (and second)
+invocation times are reported as JSON. AWS clients are replaced with
+inert stand-ins so the numbers only reflect our own start-up work.
+
+    python bench/coldstart.py --repeat 5 > coldstart.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+LAMBDAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       'lambdas')
+
+ENVIRONMENT = {
+    'DOMAIN_NAME': 'sns-to-ap.local',
+    'INFO_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:info',
+    'ALERT_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:alert',
+    'FOLLOWER_ALLOW_LIST': 'someone@mastodon.local',
+    'TABLE_NAME': 'followers',
+    'KEY_ID': 'key',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+}
+
+EVENTS = {
+    'api': {
+        'headers': {},
+        'queryStringParameters': {'resource': 'acct:sns@sns-to-ap.local'},
+        'requestContext': {'http': {'path': '/.well-known/webfinger',
+                                    'method': 'GET'}},
+    },
+    'sender': {'Records': [{'Sns': {
+        'MessageId': '00000000-0000-0000-0000-000000000000',
+        'Timestamp': '2023-10-04T21:41:53.000Z',
+        'TopicArn': ENVIRONMENT['INFO_TOPIC_ARN'],
+        'Message': 'Deployment of *api* finished: https://example.com/',
+    }}]},
+    'incoming': {'Records': [{
+        'messageId': '00000000-0000-0000-0000-000000000000',
+        'attributes': {'ApproximateReceiveCount': '1'},
+        'body': json.dumps({
+            '@context': 'https://www.w3.org/ns/activitystreams',
+            'id': 'https://mastodon.local/users/someone#undo/1',
+            'type': 'Undo',
+            'actor': 'https://mastodon.local/users/someone',
+            'object': {
+                'id': 'https://mastodon.local/follows/1',
+                'type': 'Follow',
+                'actor': 'https://mastodon.local/users/someone',
+                'object': 'https://sns-to-ap.local/users/sns',
+            },
+        }),
+    }]},
+}
+
+
+class LambdaContext:
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+def child(name):
+    """Runs in the fresh interpreter: import, then invoke twice."""
+    sys.path.insert(0, LAMBDAS)
+    started = time.perf_counter()
+    module = __import__(name)
+    imported = time.perf_counter()
+
+    # inert AWS clients, installed after the import has been timed
+    from unittest import mock
+    import dynamo
+    dynamo.dyn = mock.MagicMock()
+    dynamo.dyn.scan.return_value = {'Items': []}
+
+    timings = {'handler': name, 'import_ms': (imported - started) * 1000}
+    for label in ('first_invocation_ms', 'second_invocation_ms'):
+        started = time.perf_counter()
+        module.handler(EVENTS[name], LambdaContext())
+        timings[label] = (time.perf_counter() - started) * 1000
+    print(json.dumps(timings))
+
+
+def measure(name, repeat):
+    env = dict(os.environ, **ENVIRONMENT)
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', name],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    result = {'handler': name, 'runs': repeat}
+    for key in ('import_ms', 'first_invocation_ms', 'second_invocation_ms'):
+        result[key] = round(statistics.median(r[key] for r in runs), 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('handlers', nargs='*', default=sorted(EVENTS))
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child)
+
+    results = [measure(name, args.repeat) for name in args.handlers]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
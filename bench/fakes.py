@@ -0,0 +1,294 @@
+"""In-process stand-ins for AWS and for remote Fediverse servers.
+
+Only as much of each API is implemented as the lambdas use.
+"""
+import re
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+
+
+class FakeKms:
+    def __init__(self):
+        self.private_key = rsa.generate_private_key(65537, 2048)
+        self.calls = 0
+
+    def get_public_key(self, KeyId=None):
+        self.calls += 1
+        return {'PublicKey': self.private_key.public_key().public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+        )}
+
+    def sign(self, KeyId=None, Message=None, MessageType=None,
+             SigningAlgorithm=None):
+        self.calls += 1
+        return {'Signature': self.private_key.sign(
+            Message, padding.PKCS1v15(), hashes.SHA256()
+        )}
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class FakeDynamo:
+    """A dict-backed DynamoDB client, keyed on `id` like our tables."""
+    exceptions = type('exceptions', (), {
+        'ConditionalCheckFailedException': ConditionalCheckFailedException
+    })
+
+    def __init__(self, page_size=100):
+        self.tables = {}
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def _table(self, name, call):
+        self.calls[call] = self.calls.get(call, 0) + 1
+        return self.tables.setdefault(name, {})
+
+    def put_item(self, TableName=None, Item=None, **kwargs):
+        with self.lock:
+            table = self._table(TableName, 'put_item')
+            old = table.get(Item['id']['S'])
+            self._check(old, kwargs)
+            table[Item['id']['S']] = dict(Item)
+            return {'Attributes': old} if old and \
+                kwargs.get('ReturnValues') == 'ALL_OLD' else {}
+
+    def get_item(self, TableName=None, Key=None, **kwargs):
+        with self.lock:
+            item = self._table(TableName, 'get_item').get(Key['id']['S'])
+            return {'Item': dict(item)} if item else {}
+
+    def delete_item(self, TableName=None, Key=None, **kwargs):
+        with self.lock:
+            table = self._table(TableName, 'delete_item')
+            old = table.get(Key['id']['S'])
+            self._check(old, kwargs)
+            table.pop(Key['id']['S'], None)
+            return {'Attributes': old} if old and \
+                kwargs.get('ReturnValues') == 'ALL_OLD' else {}
+
+    def update_item(self, TableName=None, Key=None, UpdateExpression='',
+                    ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues=None,
+                    **kwargs):
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self.lock:
+            table = self._table(TableName, 'update_item')
+            old = table.get(Key['id']['S'])
+            self._check(old, dict(kwargs, ExpressionAttributeNames=names,
+                                  ExpressionAttributeValues=values))
+            item = dict(old or Key)
+            for action, clauses in re.findall(
+                    r'(SET|ADD|REMOVE)\s+(.*?)(?=\s+(?:SET|ADD|REMOVE)\s|$)',
+                    UpdateExpression):
+                for clause in clauses.split(','):
+                    parts = clause.split()
+                    name = names.get(parts[0], parts[0])
+                    if action == 'ADD' and 'SS' in values[parts[1]]:
+                        current = set(item.get(name, {'SS': []})['SS'])
+                        item[name] = {'SS': sorted(
+                            current | set(values[parts[1]]['SS'])
+                        )}
+                    elif action == 'ADD':
+                        current = float(item.get(name, {'N': '0'})['N'])
+                        total = current + float(values[parts[1]]['N'])
+                        item[name] = {'N': str(int(total) if total.is_integer()
+                                               else total)}
+                    elif action == 'SET':
+                        item[name] = values[parts[-1]]
+                    else:
+                        item.pop(name, None)
+            table[Key['id']['S']] = item
+            if ReturnValues == 'ALL_OLD':
+                return {'Attributes': old} if old else {}
+            return {'Attributes': {k: v for k, v in item.items()
+                                   if k != 'id'}}
+
+    def batch_write_item(self, RequestItems=None):
+        with self.lock:
+            for name, requests in RequestItems.items():
+                table = self._table(name, 'batch_write_item')
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        table[item['id']['S']] = dict(item)
+                    else:
+                        key = request['DeleteRequest']['Key']
+                        table.pop(key['id']['S'], None)
+        return {'UnprocessedItems': {}}
+
+    def _check(self, old, kwargs):
+        """Evaluate the handful of condition expressions we use."""
+        condition = kwargs.get('ConditionExpression')
+        if not condition:
+            return
+        names = kwargs.get('ExpressionAttributeNames') or {}
+        values = kwargs.get('ExpressionAttributeValues') or {}
+        for alternative in condition.split(' OR '):
+            if all(self._holds(_unwrap(term), old, names, values)
+                   for term in _unwrap(alternative).split(' AND ')):
+                return
+        raise ConditionalCheckFailedException(condition)
+
+    def _holds(self, term, old, names, values):
+        match = re.match(r'attribute_not_exists\((\S+)\)', term)
+        if match:
+            return old is None or names.get(match[1], match[1]) not in old
+        match = re.match(r'attribute_exists\((\S+)\)', term)
+        if match:
+            return old is not None and names.get(match[1], match[1]) in old
+        match = re.match(r'(\S+)\s*(=|<>|<)\s*(\S+)$', term)
+        if not match:
+            raise NotImplementedError(term)
+        if old is None:
+            return False
+        have, want = old.get(names.get(match[1], match[1])), values[match[3]]
+        if match[2] == '=':
+            return have == want
+        if match[2] == '<>':
+            return have != want
+        return have is not None and float(have['N']) < float(want['N'])
+
+    def scan(self, TableName=None, ExclusiveStartKey=None, Segment=0,
+             TotalSegments=1, Limit=None, **kwargs):
+        with self.lock:
+            items = sorted(self._table(TableName, 'scan').items())
+        items = [item for i, (_, item) in enumerate(items)
+                 if i % TotalSegments == Segment]
+        start = 0
+        if ExclusiveStartKey:
+            # the key may since have been deleted
+            start = sum(item['id']['S'] <= ExclusiveStartKey['id']['S']
+                        for item in items)
+        page = items[start:start + (Limit or self.page_size)]
+        response = {'Items': page, 'Count': len(page)}
+        if start + len(page) < len(items):
+            response['LastEvaluatedKey'] = {'id': page[-1]['id']}
+        return response
+
+
+def _unwrap(expression):
+    """Remove one pair of parentheses around the whole of `expression`.
+
+    >>> _unwrap('(attribute_not_exists(id))'), _unwrap('attribute_exists(id)')
+    ('attribute_not_exists(id)', 'attribute_exists(id)')
+
+    """
+    expression = expression.strip()
+    if not expression.startswith('('):
+        return expression
+    depth = 0
+    for i, char in enumerate(expression):
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        if depth == 0:
+            if i == len(expression) - 1:
+                return expression[1:-1].strip()
+            return expression
+    return expression
+
+
+class FakeSqs:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, QueueUrl=None, MessageBody=None, **kwargs):
+        self.messages.append(MessageBody)
+        return {}
+
+    def send_message_batch(self, QueueUrl=None, Entries=None):
+        self.messages.extend(e['MessageBody'] for e in Entries)
+        return {'Successful': Entries}
+
+
+class LambdaContext:
+    def __init__(self, timeout=900):
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+class RemoteServer:
+    """A local HTTP server standing in for a remote instance.
+
+    It serves actor documents for `/users/<n>` and accepts POSTs to
+    their inboxes and to a shared `/inbox`, after `latency` seconds and
+    failing with a 503 `failure_rate` of the time.
+    """
+    def __init__(self, address='127.0.0.1', latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.private_key = rsa.generate_private_key(65537, 2048)
+        self.public_pem = self.private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+        self.received = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def reply(self, status, body=b''):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/activity+json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                self.reply(200, json.dumps(server.actor(self.path)).encode())
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                time.sleep(server.latency)
+                if random.random() < server.failure_rate:
+                    return self.reply(503)
+                with server.lock:
+                    server.received += 1
+                self.reply(202)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((address, 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base = f'http://{address}:{self.httpd.server_address[1]}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def actor(self, path):
+        actor_id = self.base + path.split('#')[0]
+        return {
+            'id': actor_id,
+            'type': 'Person',
+            'preferredUsername': actor_id.rsplit('/', 1)[-1],
+            'inbox': actor_id + '/inbox',
+            'endpoints': {'sharedInbox': self.base + '/inbox'},
+            'publicKey': {
+                'id': actor_id + '#main-key',
+                'owner': actor_id,
+                'publicKeyPem': self.public_pem,
+            },
+        }
+
+    def sign(self, message):
+        return self.private_key.sign(message, padding.PKCS1v15(),
+                                     hashes.SHA256())
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,321 @@
+"""Offline benchmarks for the delivery, inbox and incoming paths.
+
+AWS is replaced by the in-process fakes in bench/fakes.py and remote
+instances by local HTTP servers (one per loopback address, so each is a
+distinct host) with configurable latency and failure rate. Results are
+printed as JSON, tagged with the current commit, so runs can be
+compared between commits:
+
+    python bench/run.py --followers 10,100,1000 --latency 0.02 \\
+        --output bench_output.txt
+"""
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'lambdas'))
+sys.path.insert(0, HERE)
+
+os.environ.update({
+    'DOMAIN_NAME': 'sns-to-ap.local',
+    'INFO_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:info',
+    'ALERT_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:alert',
+    'FOLLOWER_ALLOW_LIST': '',
+    'TABLE_NAME': 'followers',
+    'STATE_TABLE_NAME': 'state',
+    'INCOMING_QUEUE': 'incoming',
+    'KEY_ID': 'key',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING'),
+})
+
+import fakes  # noqa: E402
+import api  # noqa: E402
+import config  # noqa: E402
+import dynamo  # noqa: E402
+import queues  # noqa: E402
+import sender  # noqa: E402
+import metrics  # noqa: E402
+import delivery  # noqa: E402
+import incoming  # noqa: E402
+import followers  # noqa: E402
+import processed  # noqa: E402
+import apub.http  # noqa: E402
+import apub.keys  # noqa: E402
+import apub.breaker  # noqa: E402
+import apub.signatures  # noqa: E402
+
+# the handlers print an EMF record per invocation; keep stdout for results
+metrics.flush = lambda function: metrics.reset()
+
+
+def percentiles(values):
+    return {
+        'p50_ms': round(metrics.percentile(values, 50) * 1000, 3),
+        'p99_ms': round(metrics.percentile(values, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(values) * 1000, 3),
+    }
+
+
+class Environment:
+    """Fresh fakes and caches for each benchmark case."""
+    def __init__(self, instances, latency, failure_rate):
+        self.failure_rate = failure_rate
+        self.servers = [
+            fakes.RemoteServer(f'127.0.0.{i + 2}', latency, failure_rate)
+            for i in range(instances)
+        ]
+
+    def reset(self):
+        self.dyn = fakes.FakeDynamo()
+        self.kms = fakes.FakeKms()
+        self.sqs = fakes.FakeSqs()
+        dynamo.dyn = self.dyn
+        apub.signatures.kms = self.kms
+        apub.signatures._signer = None
+        api.sqs = self.sqs
+        api.actor_document.cache_clear()
+        followers._snapshot = None
+        processed.RECENT.clear()
+        apub.keys.MEMORY.clear()
+        apub.http.GET_CACHE.clear()
+        apub.breaker.HOSTS.clear()
+        apub.http.POOL.close()
+        for server in self.servers:
+            server.received = 0
+
+    def actor(self, n):
+        server = self.servers[n % len(self.servers)]
+        return server, f'{server.base}/users/{n}'
+
+    def seed_followers(self, count):
+        for n in range(count):
+            server, actor_id = self.actor(n)
+            dynamo.put({
+                'id': actor_id,
+                'follow_id': f'{actor_id}#follow',
+                'actor_id': actor_id,
+                'inbox': f'{actor_id}/inbox',
+                'shared_inbox': f'{server.base}/inbox',
+                'username': str(n),
+            })
+
+    def received(self):
+        return sum(server.received for server in self.servers)
+
+    def close(self):
+        apub.http.POOL.close()
+        for server in self.servers:
+            server.close()
+
+
+def sns_event(topic):
+    return {'Records': [{'Sns': {
+        'MessageId': '00000000-0000-0000-0000-000000000000',
+        'Timestamp': '2023-10-04T21:41:53.000Z',
+        'TopicArn': os.environ[f'{topic.upper()}_TOPIC_ARN'],
+        'Message': 'CPU utilization above 90% on https://example.com/',
+    }}]}
+
+
+def bench_fanout(env, count, topic, mode):
+    env.reset()
+    env.seed_followers(count)
+    queue = queues.MemoryQueue() if mode == 'queued' else None
+    queues.delivery_queue = lambda: queue
+
+    started = time.perf_counter()
+    sender.handler(sns_event(topic), fakes.LambdaContext())
+    planned = time.perf_counter() - started
+
+    if queue is not None:
+        def worker(event, context):
+            return delivery.handler(event, fakes.LambdaContext(), queue)
+        while len(queue):
+            if not queue.process(worker, max_messages=50):
+                queue.advance(config.DELIVERY_BACKOFF_MAX)
+    elapsed = time.perf_counter() - started
+
+    # alerts go to each follower, info posts to each shared inbox
+    expected = count if topic == 'alert' else min(count, len(env.servers))
+    assert env.received() > 0, 'nothing was delivered'
+    assert env.failure_rate or env.received() == expected, \
+        f'delivered {env.received()} of {expected}'
+
+    result = {
+        'benchmark': 'sender.fanout',
+        'mode': mode,
+        'topic': topic,
+        'followers': count,
+        'deliveries': env.received(),
+        'seconds': round(elapsed, 4),
+        'deliveries_per_second': round(env.received() / elapsed, 1),
+        'kms_calls': env.kms.calls,
+    }
+    if queue is not None:
+        result['planning_seconds'] = round(planned, 4)
+    return result
+
+
+def signed_inbox_event(server, actor_id, activity):
+    body = json.dumps(activity)
+    digest = 'SHA-256=' + base64.b64encode(
+        hashlib.sha256(body.encode()).digest()
+    ).decode()
+    date = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
+    signed = (f'(request-target): post {config.ACTOR_INBOX_PATH}\n'
+              f'host: {config.DOMAIN}\ndate: {date}\ndigest: {digest}')
+    signature = base64.b64encode(server.sign(signed.encode())).decode()
+    return {
+        'headers': {
+            'host': config.DOMAIN,
+            'date': date,
+            'digest': digest,
+            'content-type': 'application/activity+json',
+            'signature': (f'keyId="{actor_id}#main-key",'
+                          f'headers="(request-target) host date digest",'
+                          f'signature="{signature}"'),
+        },
+        'body': body,
+        'requestContext': {'http': {'path': config.ACTOR_INBOX_PATH,
+                                    'method': 'POST'}},
+    }
+
+
+def follow(actor_id, n):
+    return {
+        '@context': 'https://www.w3.org/ns/activitystreams',
+        'id': f'{actor_id}#follows/{n}',
+        'type': 'Follow',
+        'actor': actor_id,
+        'object': config.ACTOR,
+    }
+
+
+def bench_inbox(env, requests, actors):
+    env.reset()
+    cold, warm = [], []
+    seen = set()
+    for n in range(requests):
+        server, actor_id = env.actor(n % actors)
+        event = signed_inbox_event(server, actor_id, follow(actor_id, n))
+        started = time.perf_counter()
+        response = api.handler(event, fakes.LambdaContext())
+        elapsed = time.perf_counter() - started
+        assert response['statusCode'] == 204, response
+        (warm if actor_id in seen else cold).append(elapsed)
+        seen.add(actor_id)
+
+    return {
+        'benchmark': 'api.actor_inbox',
+        'requests': requests,
+        'actors': actors,
+        'cold_key': percentiles(cold),
+        'warm_key': percentiles(warm) if warm else None,
+        'enqueued': len(env.sqs.messages),
+    }
+
+
+def bench_incoming(env, records, batch_size=10):
+    env.reset()
+    config.FOLLOWERS = [f'{n}@{env.actor(n)[1].split("/")[2]}'
+                        for n in range(records)]
+    batches = []
+    for start in range(0, records, batch_size):
+        batches.append({'Records': [{
+            'messageId': f'message-{n}',
+            'attributes': {'ApproximateReceiveCount': '1'},
+            'body': json.dumps(follow(env.actor(n)[1], n)),
+        } for n in range(start, min(start + batch_size, records))]})
+
+    timings = []
+    failures = 0
+    started = time.perf_counter()
+    for batch in batches:
+        batch_started = time.perf_counter()
+        response = incoming.handler(batch, fakes.LambdaContext())
+        timings.append(time.perf_counter() - batch_started)
+        failures += len(response['batchItemFailures'])
+    elapsed = time.perf_counter() - started
+
+    # every Follow is either accepted or reported for a retry
+    assert env.received() + failures == records, \
+        f'{env.received()} accepted and {failures} failed of {records}'
+
+    return {
+        'benchmark': 'incoming.handler',
+        'records': records,
+        'batch_size': batch_size,
+        'failures': failures,
+        'seconds': round(elapsed, 4),
+        'records_per_second': round(records / elapsed, 1),
+        'batch': percentiles(timings),
+    }
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--followers', default='10,100,1000',
+                        help='comma-separated follower counts')
+    parser.add_argument('--instances', type=int, default=8,
+                        help='number of simulated remote instances')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='remote response latency in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='fraction of remote POSTs that fail with 503')
+    parser.add_argument('--inbox-requests', type=int, default=200)
+    parser.add_argument('--incoming-records', type=int, default=100)
+    parser.add_argument('--only', choices=['fanout', 'inbox', 'incoming'],
+                        action='append')
+    parser.add_argument('--output', help='also write results to this file')
+    args = parser.parse_args()
+    only = set(args.only or ['fanout', 'inbox', 'incoming'])
+
+    env = Environment(args.instances, args.latency, args.failure_rate)
+    results = []
+    try:
+        if 'fanout' in only:
+            for count in [int(n) for n in args.followers.split(',')]:
+                for mode in ('inline', 'queued'):
+                    results.append(bench_fanout(env, count, 'alert', mode))
+                results.append(bench_fanout(env, count, 'info', 'inline'))
+        if 'inbox' in only:
+            results.append(bench_inbox(env, args.inbox_requests,
+                                       actors=max(1, args.inbox_requests // 10)))
+        if 'incoming' in only:
+            results.append(bench_incoming(env, args.incoming_records))
+    finally:
+        env.close()
+
+    report = json.dumps({
+        'commit': commit(),
+        'python': platform.python_version(),
+        'parameters': vars(args),
+        'results': results,
+    }, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,4 +2,32 @@ import os
 
 os.environ['DOMAIN_NAME'] = 'sns-to-ap.local'
 os.environ['INFO_TOPIC_ARN'] = 'arn:aws::foo'
-os.environ['ALERT_TOPIC_ARN'] = 'arn:aws::foo'
+os.environ['ALERT_TOPIC_ARN'] = 'arn:aws::bar'
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def fresh_get_cache():
+    # fetched documents mustn't leak from one test's mocks into the next
+    from apub import http
+    http.GET_CACHE.clear()
+    yield
+    http.GET_CACHE.clear()
+
+
+@pytest.fixture
+def fake_dynamo(monkeypatch):
+    """Both tables on the benchmarks' condition-evaluating fake client.
+
+    Items are in `tables['followers']` and `tables['state']`.
+    """
+    import dynamo
+    from bench.fakes import FakeDynamo
+
+    client = FakeDynamo(page_size=2)
+    monkeypatch.setattr(dynamo, 'dyn', client)
+    monkeypatch.setenv('TABLE_NAME', 'followers')
+    monkeypatch.setenv('STATE_TABLE_NAME', 'state')
+    return client
@@ -1,39 +1,59 @@
 import os
 import json
-import boto3
 import base64
-import traceback
+import functools
+from datetime import datetime
 
+import aws
+import log
+import metrics
 import config
+import dynamo
+import followers
+import objects
+import apub.http
 import apub.utils
 import apub.signatures
 
 from apig_http import router
-from apig_http.responses import HttpResponse
+from apig_http.responses import HttpResponse, CachedDocument
 
-sqs = boto3.client('sqs')
+logger = log.get('api')
+
+sqs = None
+
+
+def _sqs():
+    return sqs or aws.client('sqs')
+
+
+@functools.lru_cache(maxsize=None)
+def webfinger_document():
+    return CachedDocument({
+        'subject': 'acct:' + config.ACCOUNT,
+        'links': [{
+            'rel': 'self',
+            'type': 'application/activity+json',
+            'href': config.ACTOR
+        }]
+    }, max_age=86400)
 
 
 @router.register('/.well-known/webfinger')
 def webfinger(event, context):
     qsp = event['queryStringParameters']
     if qsp.get('resource') == f'acct:{config.ACCOUNT}':
-        return HttpResponse({
-            'subject': 'acct:' + config.ACCOUNT,
-            'links': [{
-                'rel': 'self',
-                'type': 'application/activity+json',
-                'href': config.ACTOR
-            }]
-        })
+        return webfinger_document().respond(event)
     
     return HttpResponse('Not Found', 404)
 
 
-@router.register(config.ACTOR_PATH)
-def actor_doc(event, context):
+@functools.lru_cache(maxsize=None)
+def actor_document():
+    # built once per container, so the KMS public key lookup only
+    # happens on a cold start
     pub_key = apub.signatures.get_public_key()
-    return HttpResponse({
+    return CachedDocument({
         "@context": [
             "https://www.w3.org/ns/activitystreams",
             "https://w3id.org/security/v1",
@@ -50,31 +70,181 @@ def actor_doc(event, context):
             "owner": config.ACTOR,
             "publicKeyPem": pub_key,
         }
-    })
+    }, max_age=3600)
+
+
+@router.register(config.ACTOR_PATH)
+def actor_doc(event, context):
+    return actor_document().respond(event)
     
 
-@router.register(config.ACTOR_INBOX_PATH, 'POST')
+def encode_cursor(id):
+    """Turn a follower id into an opaque, URL-safe page cursor.
+
+    >>> encode_cursor('https://a.local/users/a')
+    'aHR0cHM6Ly9hLmxvY2FsL3VzZXJzL2E'
+    >>> decode_cursor(_)
+    'https://a.local/users/a'
+
+    """
+    return base64.urlsafe_b64encode(id.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    return base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+
+
+@router.register(config.ACTOR_FOLLOWERS_PATH)
+def followers_collection(event, context):
+    qsp = event.get('queryStringParameters') or {}
+    if 'page' not in qsp:
+        document = {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": config.ACTOR_FOLLOWERS,
+            "type": "OrderedCollection",
+            "totalItems": followers.count(),
+            "first": f'{config.ACTOR_FOLLOWERS}?page=true',
+        }
+    else:
+        try:
+            start = decode_cursor(qsp['cursor']) if 'cursor' in qsp else None
+        except ValueError:
+            return HttpResponse('Bad cursor', 400)
+        # pages are read straight from the table, a page at a time
+        items, last = dynamo.page(config.FOLLOWERS_PAGE_SIZE, start,
+                                  attributes=('id', 'actor_id'))
+        page_id = f'{config.ACTOR_FOLLOWERS}?page=true'
+        if start is not None:
+            page_id += f'&cursor={qsp["cursor"]}'
+        document = {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": page_id,
+            "type": "OrderedCollectionPage",
+            "partOf": config.ACTOR_FOLLOWERS,
+            "orderedItems": [*dict.fromkeys(
+                item['actor_id'] for item in items if 'actor_id' in item
+            )],
+        }
+        if last is not None:
+            document['next'] = (f'{config.ACTOR_FOLLOWERS}?page=true'
+                                f'&cursor={encode_cursor(last)}')
+
+    return CachedDocument(
+        document, max_age=config.FOLLOWERS_MAX_AGE,
+        content_type='application/activity+json'
+    ).respond(event)
+
+
+def _published(event):
+    message_id = event['pathParameters']['message_id']
+    # SNS message ids are UUIDs; don't go looking for anything else
+    if len(message_id) > 64 or not message_id.replace('-', '').isalnum():
+        return None
+    return objects.load(message_id)
+
+
+def _published_at(activity):
+    try:
+        return datetime.fromisoformat(
+            activity['object']['published'].replace('Z', '+00:00')
+        )
+    except (KeyError, ValueError):
+        return None
+
+
+def _object_response(event, document, activity):
+    return CachedDocument(
+        document, max_age=config.OBJECT_MAX_AGE,
+        content_type='application/activity+json', immutable=True,
+        last_modified=_published_at(activity)
+    ).respond(event)
+
+
+@router.register('/create/{message_id}')
+def create_activity(event, context):
+    activity = _published(event)
+    if activity is None:
+        return HttpResponse('Not Found', 404)
+    return _object_response(event, activity, activity)
+
+
+@router.register('/{message_id}')
+def note(event, context):
+    activity = _published(event)
+    if activity is None:
+        return HttpResponse('Not Found', 404)
+    return _object_response(event, dict(
+        {'@context': activity['@context']}, **activity['object']
+    ), activity)
+
+
+def _enqueue(body):
+    _sqs().send_message(
+        QueueUrl=os.environ['INCOMING_QUEUE'],
+        MessageBody=body
+    )
+
+
 @apub.signatures.wrapped_verify_headers
-def actor_inbox(event, context):
+def verified_inbox(event, context):
     # double-check that the event's actor is the same as the one
     # sending the message
     body = json.loads(event['body'])
     if apub.utils.trim_frag(body.get('id', '')) != event['actor']:
-        print(apub.utils.trim_frag(body.get('id', '')), event['actor'])
+        logger.warning('activity %s does not belong to signer %s',
+                       body.get('id'), event['actor'])
         return HttpResponse('Mismatched key', 403)
     
     # send it on to the incoming handler for processing
-    sqs.send_message(
-        QueueUrl=os.environ['INCOMING_QUEUE'],
-        MessageBody=event['body']
-    )
+    _enqueue(event['body'])
 
     return HttpResponse('', 204)
 
 
+def deferred_inbox(event, context):
+    # only the cheap checks happen here - the incoming handler verifies
+    # the signature before acting on the activity
+    body = event.get('body', '')
+    if len(body.encode()) > config.INBOX_MAX_BYTES:
+        return HttpResponse('Payload Too Large', 413)
+    try:
+        key_id = apub.signatures.precheck(event['headers'], body)
+    except apub.signatures.InvalidSignature as ex:
+        logger.info('rejected request signature: %s', ex)
+        return HttpResponse('Invalid HTTP signature', 403)
+
+    message = json.dumps({'signed_request': {
+        'headers': event['headers'],
+        'method': event['requestContext']['http']['method'].lower(),
+        'path': event['requestContext']['http']['path'],
+        'body': body,
+    }})
+    # escaping the body and adding the headers can push a request that
+    # passed the check above over the queue's limit
+    if len(message.encode()) > config.INBOX_MAX_BYTES:
+        return HttpResponse('Payload Too Large', 413)
+
+    logger.debug('deferring verification of %s', key_id)
+    _enqueue(message)
+
+    return HttpResponse('', 202)
+
+
+@router.register(config.ACTOR_INBOX_PATH, 'POST')
+def actor_inbox(event, context):
+    if config.INBOX_MODE == 'defer':
+        return deferred_inbox(event, context)
+    return verified_inbox(event, context)
+
+
+@metrics.instrument('api')
 def handler(event, context):
-    print(json.dumps(event))
+    logger.debug('event: %s', log.Payload(event))
+    apub.http.set_deadline(context)
 
-    response = router.handle(event, context)
-    print(json.dumps(response.to_http()))
-    return response.to_http()
+    response = router.handle(event, context).to_http()
+    logger.info('%s %s: %s', event['requestContext']['http']['method'],
+                event['requestContext']['http']['path'],
+                response['statusCode'])
+    logger.debug('response: %s', log.Payload(response))
+    return response
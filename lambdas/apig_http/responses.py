@@ -1,4 +1,12 @@
+import gzip
 import json
+import base64
+import hashlib
+import functools
+from email.utils import format_datetime, parsedate_to_datetime
+
+# bodies smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 1024
 
 
 class HttpResponse:
@@ -30,9 +38,10 @@ class HttpResponse:
      'headers': {}}
 
     """
-    def __init__(self, body='', status_code=200):
-        self.headers = {}
+    def __init__(self, body='', status_code=200, headers=None):
+        self.headers = dict(headers or {})
         self.status_code = status_code
+        self.is_base64 = False
         
         if isinstance(body, dict):
             self.body = json.dumps(body)
@@ -45,18 +54,222 @@ class HttpResponse:
             self.body = ''
             self.status_code = 204
             
-        return {
+        response = {
             'statusCode': self.status_code,
             'statusDescription': {
                 200: 'OK',
+                202: 'Accepted',
                 204: 'No Content',
+                304: 'Not Modified',
+                400: 'Bad Request',
                 401: 'Unauthorized',
                 403: 'Forbidden',
                 404: 'Not Found',
+                413: 'Payload Too Large',
                 500: 'Server error',
             }.get(self.status_code, 'Unsure'),
             'body': self.body,
             'headers': self.headers,
         }
+        if self.is_base64:
+            response['isBase64Encoded'] = True
+        return response
+
+
+def etag(body):
+    """Compute a strong entity tag for a response body.
+
+    >>> etag('hello world')
+    '"b94d27b9934d3e08a52e52d7da7dabfa"'
+
+    """
+    return '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(event, tag):
+    """Check whether the request's If-None-Match header matches `tag`.
+
+    Tags are compared weakly, as a gzipped copy of a document has the
+    same tag made weak.
+
+    >>> etag_matches({'headers': {'if-none-match': 'W/"a", "b"'}}, '"a"')
+    True
+    >>> etag_matches({'headers': {'if-none-match': '"a"'}}, 'W/"a"')
+    True
+    >>> etag_matches({'headers': {'if-none-match': '*'}}, '"a"')
+    True
+    >>> etag_matches({'headers': {}}, '"a"')
+    False
+
+    """
+    header = (event.get('headers') or {}).get('if-none-match')
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(',')]
+    return '*' in candidates or _opaque(tag) in map(_opaque, candidates)
+
+
+def _opaque(tag):
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def _unchanged_since(since, last_modified):
+    try:
+        return parsedate_to_datetime(last_modified) <= \
+            parsedate_to_datetime(since)
+    except (TypeError, ValueError):
+        return False
+
+
+def conditional(event, response):
+    """Answer a conditional GET with a 304 if the client's copy is current.
+
+    Successful responses get an ETag computed from their body if they
+    don't already have one. If-None-Match is checked against it, or
+    failing that If-Modified-Since against any Last-Modified header.
+
+    It runs after `compress`, so a 304 carries the same ETag and Vary
+    as the response it stands in for.
+
+    >>> event = {'requestContext': {'http': {'method': 'GET'}},
+    ...          'headers': {'if-none-match': etag('hello world')}}
+    >>> conditional(event, HttpResponse('hello world')).status_code
+    304
+    >>> event['headers'] = {
+    ...     'if-modified-since': 'Wed, 04 Oct 2023 21:41:53 GMT'}
+    >>> conditional(event, HttpResponse('hello world', headers={
+    ...     'Last-Modified': 'Wed, 04 Oct 2023 21:41:53 GMT'})).status_code
+    304
+    >>> conditional(event, HttpResponse('hello world', headers={
+    ...     'Last-Modified': 'Thu, 05 Oct 2023 08:00:00 GMT'})).status_code
+    200
+
+    """
+    method = event.get('requestContext', {}).get('http', {}).get('method')
+    if method not in ('GET', 'HEAD') or response.status_code != 200 or \
+            not response.body:
+        return response
+
+    tag = response.headers.setdefault('ETag', etag(response.body))
+    headers = event.get('headers') or {}
+    if 'if-none-match' in headers:
+        current = etag_matches(event, tag)
+    else:
+        current = _unchanged_since(headers.get('if-modified-since'),
+                                   response.headers.get('Last-Modified'))
+    if not current:
+        return response
+    return HttpResponse('', 304, headers={
+        k: v for k, v in response.headers.items()
+        if k not in ('Content-Type', 'Content-Encoding')
+    })
+
+
+def accepts_gzip(event):
+    """Check whether the request's Accept-Encoding allows gzip.
+
+    >>> accepts_gzip({'headers': {'accept-encoding': 'gzip, deflate, br'}})
+    True
+    >>> accepts_gzip({'headers': {'accept-encoding': 'br, gzip;q=0'}})
+    False
+    >>> accepts_gzip({'headers': {}})
+    False
+
+    """
+    header = (event.get('headers') or {}).get('accept-encoding', '')
+    for coding in header.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        try:
+            return float(params.strip().partition('q=')[2] or 1) > 0
+        except ValueError:
+            return False
+    return False
+
+
+@functools.lru_cache(maxsize=32)
+def gzip_body(body):
+    # cached, since the same few documents are served again and again
+    return base64.b64encode(gzip.compress(body.encode(), mtime=0)).decode()
+
+
+def compress(event, response):
+    """Gzip a large response body if the client accepts it.
+
+    API Gateway is told the body is base64 encoded, and the ETag is
+    made weak since the bytes sent differ from the document's. The tag
+    is computed from the document first if the response has none.
+
+    >>> response = compress({'headers': {'accept-encoding': 'gzip'}},
+    ...                     HttpResponse('x' * GZIP_MIN_BYTES,
+    ...                                  headers={'ETag': '"a"'}))
+    >>> response.to_http()  #doctest: +NORMALIZE_WHITESPACE +ELLIPSIS
+    {'statusCode': 200, 'statusDescription': 'OK', 'body': 'H4sI...',
+     'headers': {'ETag': 'W/"a"', 'Vary': 'Accept-Encoding',
+                 'Content-Encoding': 'gzip'},
+     'isBase64Encoded': True}
+
+    """
+    if response.is_base64 or not isinstance(response.body, str) or \
+            len(response.body) < GZIP_MIN_BYTES:
+        return response
+
+    response.headers['Vary'] = 'Accept-Encoding'
+    if not accepts_gzip(event):
+        return response
+
+    tag = response.headers.setdefault('ETag', etag(response.body))
+    response.body = gzip_body(response.body)
+    response.is_base64 = True
+    response.headers['Content-Encoding'] = 'gzip'
+    if not tag.startswith('W/'):
+        response.headers['ETag'] = 'W/' + tag
+    return response
+
+
+class CachedDocument:
+    """A JSON document serialized once and served with cache validators.
+
+    Repeat fetches carrying the document's ETag get a bodiless 304 from
+    the router's `conditional` middleware.
+
+    >>> doc = CachedDocument({'he': 'llo'}, max_age=60)
+    >>> doc.respond({'headers': {}}).to_http()
+    ... #doctest: +NORMALIZE_WHITESPACE +ELLIPSIS
+    {'statusCode': 200, 'statusDescription': 'OK', 'body': '{"he": "llo"}',
+     'headers': {'ETag': '"..."', 'Cache-Control': 'public, max-age=60',
+                 'Content-Type': 'application/jrd+json'}}
+    >>> event = {'headers': {'if-none-match': doc.etag},
+    ...          'requestContext': {'http': {'method': 'GET'}}}
+    >>> conditional(event, doc.respond(event)).status_code
+    304
+
+    Documents that will never change can say so, sparing clients the
+    revalidation.
+
+    >>> CachedDocument({}, max_age=60, immutable=True).headers['Cache-Control']
+    'public, max-age=60, immutable'
+
+    """
+    def __init__(self, body, max_age=3600,
+                 content_type='application/jrd+json', immutable=False,
+                 last_modified=None):
+        self.body = json.dumps(body)
+        self.etag = etag(self.body)
+        cache_control = f'public, max-age={max_age}'
+        if immutable:
+            cache_control += ', immutable'
+        self.headers = {
+            'ETag': self.etag,
+            'Cache-Control': cache_control,
+        }
+        if last_modified is not None:
+            self.headers['Last-Modified'] = format_datetime(last_modified,
+                                                            usegmt=True)
+        self.content_type = content_type
 
-    
+    def respond(self, event):
+        return HttpResponse(self.body, headers=dict(
+            self.headers, **{'Content-Type': self.content_type}
+        ))
@@ -1,9 +1,17 @@
-import traceback
+import re
 
+import log
 from apig_http import responses
 
+logger = log.get('router')
+
 
 ROUTES = {}
+PATTERNS = []
+
+# applied in turn to every route's response; conditional comes last so
+# that a 304 repeats the headers compress set on the full response
+MIDDLEWARE = [responses.compress, responses.conditional]
 
 def register(path, method='GET'):
     """Register a function as a route handler.
@@ -14,13 +22,44 @@ def register(path, method='GET'):
     >>> ROUTES['/hello']['GET']  #doctest: +ELLIPSIS
     <function handle_hello at ...>
 
+    A `{name}` path segment matches any single segment, which is
+    passed to the handler in the event's `pathParameters`. Fixed paths
+    are matched first.
+
+    >>> @register('/hello/{name}')
+    ... def handle_hello_name(event, context):
+    ...     return responses.HttpResponse(event['pathParameters']['name'])
+
     """
     def _inner(func):
+        if path not in ROUTES and '{' in path:
+            PATTERNS.append((re.compile('^' + re.sub(
+                r'\\{(\w+)\\}', r'(?P<\1>[^/]+)', re.escape(path)
+            ) + '$'), path))
         ROUTES.setdefault(path, {})[method] = func
         return func
     return _inner
 
 
+def resolve(event):
+    """Find the registered path for a request.
+
+    >>> event = {'requestContext': {'http': {'path': '/hello/sam'}}}
+    >>> resolve(event), event['pathParameters']
+    ('/hello/{name}', {'name': 'sam'})
+
+    """
+    path = event['requestContext']['http']['path']
+    if path in ROUTES:
+        return path
+    for pattern, route in PATTERNS:
+        match = pattern.match(path)
+        if match:
+            event['pathParameters'] = match.groupdict()
+            return route
+    return None
+
+
 def handle(event, context):
     """Process an incoming HTTP request from API Gateway.
 
@@ -40,13 +79,17 @@ def handle(event, context):
     method = event['requestContext']['http']['method']
 
     try:
-        if path in ROUTES and method in ROUTES[path]:
-            response = ROUTES[path][method](event, context)
+        route = resolve(event)
+        if route is not None and method in ROUTES[route]:
+            response = ROUTES[route][method](event, context)
         else:
             response = responses.HttpResponse('Not Found', 404)
 
-    except Exception as ex:
-        traceback.print_exc()
+        for middleware in MIDDLEWARE:
+            response = middleware(event, response)
+
+    except Exception:
+        logger.exception('error handling %s %s', method, path)
         response = responses.HttpResponse('Server error', 500)
 
     return response
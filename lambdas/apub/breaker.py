@@ -0,0 +1,113 @@
+"""Per-host circuit breaker for outbound requests.
+
+After BREAKER_THRESHOLD consecutive failures (connection errors,
+timeouts or 5xx responses) a host is skipped for BREAKER_COOLDOWN
+seconds, after which a single probe request is let through: if it
+succeeds the host is back in service, otherwise it's skipped for
+another cooldown. The breaker state is kept in the state table so that
+all containers learn about a dead host at once; each container rereads
+it at most every BREAKER_REFRESH seconds.
+"""
+import time
+import threading
+
+import log
+import config
+import dynamo
+
+logger = log.get('breaker')
+
+LOCK = threading.Lock()
+HOSTS = {}
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def _state(host):
+    """Return the in-memory state for `host`, refreshed if stale.
+
+    The state table is read without LOCK held, so that requests to
+    other hosts aren't held up behind it; take LOCK to use the state.
+    """
+    now = time.time()
+    state = HOSTS.get(host)
+    stale = state is not None and dynamo.state_enabled() and (
+        now - state['loaded'] > config.BREAKER_REFRESH
+    )
+    if state is not None and not stale:
+        return state
+
+    item = dynamo.get_state(f'breaker#{host}') or {}
+    with LOCK:
+        state = HOSTS.setdefault(host, {'probing': False, 'loaded': None})
+        # unless another thread has refreshed it in the meantime
+        if state['loaded'] is None or state['loaded'] < now:
+            state.update(failures=item.get('failures', 0),
+                         open_until=item.get('open_until', 0),
+                         loaded=now)
+    return state
+
+
+def _save(host, state):
+    if state['failures']:
+        dynamo.put_state({
+            'id': f'breaker#{host}',
+            'failures': state['failures'],
+            'open_until': state['open_until'],
+        }, ttl=config.BREAKER_COOLDOWN * 4)
+    else:
+        dynamo.delete_state(f'breaker#{host}')
+
+
+def check(host):
+    """Raise CircuitOpen if requests to `host` should be skipped.
+
+    Returns True if the request is the probe of a half-open circuit, in
+    which case the caller must `release` it once it's done.
+    """
+    state = _state(host)
+    with LOCK:
+        if state['failures'] < config.BREAKER_THRESHOLD:
+            return False
+        if time.time() < state['open_until'] or state['probing']:
+            raise CircuitOpen(host)
+        # half-open: let this request through as the probe
+        state['probing'] = True
+        return True
+
+
+def success(host):
+    state = _state(host)
+    with LOCK:
+        state['probing'] = False
+        if not state['failures']:
+            return
+        state['failures'] = 0
+        state['open_until'] = 0
+    _save(host, state)
+
+
+def failure(host):
+    state = _state(host)
+    with LOCK:
+        state['probing'] = False
+        state['failures'] += 1
+        if state['failures'] >= config.BREAKER_THRESHOLD:
+            state['open_until'] = time.time() + config.BREAKER_COOLDOWN
+            logger.warning('circuit open for %s after %d failures', host,
+                           state['failures'])
+    _save(host, state)
+
+
+def release(host):
+    """Let another probe through.
+
+    success() and failure() do this too; release covers probes that
+    ended some other way, e.g. with a UnicodeError for a bad hostname.
+    """
+    state = HOSTS.get(host)
+    if state is not None:
+        with LOCK:
+            state['probing'] = False
@@ -0,0 +1,172 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LRUCache:
+    """A thread-safe, size-bounded mapping with expiring entries.
+
+    The least recently used entry is evicted once `maxsize` is
+    exceeded, and entries older than `ttl` seconds are treated as
+    missing.
+
+    >>> c = LRUCache(maxsize=2, ttl=60)
+    >>> c.set('a', 1); c.set('b', 2); c.get('a')
+    1
+    >>> c.set('c', 3)
+    >>> c.get('b') is None, c.get('a'), c.get('c')
+    (True, 1, 3)
+    >>> c.set('d', 4, ttl=-1)
+    >>> c.get('d', 'expired')
+    'expired'
+
+    """
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value, expires = self.entries[key]
+            if expires is not None and time.monotonic() >= expires:
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class FetchCache:
+    """Documents fetched by `load`, kept in an LRUCache.
+
+    - Concurrent misses for the same key share a single load.
+    - Entries are fresh for `ttl` seconds. For `stale` seconds after
+      that they're still returned, while a background load refreshes
+      them.
+    - For a failure, `negative` may return a lifetime and a function
+      making the exception to raise; hits raise a new one until the
+      failure is forgotten, rather than raising the same object again
+      from every thread.
+
+    Hits, stale hits, misses and remembered failures are counted in
+    `stats`, and reported to `counter` if one is given.
+
+    >>> loads = []
+    >>> def load(key):
+    ...     loads.append(key)
+    ...     if key == 'missing':
+    ...         raise KeyError(key)
+    ...     return key.upper()
+    >>> c = FetchCache(load, ttl=60,
+    ...                negative=lambda ex: (60, lambda: KeyError(*ex.args)))
+    >>> c.get('a'), c.get('a'), loads
+    ('A', 'A', ['a'])
+    >>> for _ in range(2):
+    ...     try:
+    ...         c.get('missing')
+    ...     except KeyError:
+    ...         pass
+    >>> loads, c.stats
+    (['a', 'missing'], {'hit': 1, 'stale': 0, 'miss': 2, 'negative': 1})
+
+    """
+    def __init__(self, load, maxsize=256, ttl=60, stale=0, negative=None,
+                 counter=None):
+        self.load = load
+        self.ttl = ttl
+        self.stale = stale
+        self.negative = negative or (lambda ex: None)
+        self.counter = counter
+        self.entries = LRUCache(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.stats = dict.fromkeys(('hit', 'stale', 'miss', 'negative'), 0)
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+        if self.counter is not None:
+            self.counter(name)
+
+    def get(self, key, refresh=False):
+        """Return the document for `key`, loading it if need be.
+
+        `refresh` skips the cache, though not a load already under way.
+        """
+        entry = None if refresh else self.entries.get(key)
+        if entry is None:
+            self._count('miss')
+            return self._load(key).result()
+
+        value, error, fresh_until = entry
+        if error is not None:
+            self._count('negative')
+            raise error()
+        if time.monotonic() < fresh_until:
+            self._count('hit')
+        else:
+            self._count('stale')
+            self._load(key, background=True)
+        return value
+
+    def _load(self, key, background=False):
+        with self.lock:
+            future = self.loading.get(key)
+            owner = future is None
+            if owner:
+                future = self.loading[key] = Future()
+        if owner:
+            if background:
+                threading.Thread(target=self._fill, args=(key, future),
+                                 daemon=True).start()
+            else:
+                self._fill(key, future)
+        return future
+
+    def _fill(self, key, future):
+        try:
+            value = self.load(key)
+        except Exception as ex:
+            remembered = self.negative(ex)
+            if remembered:
+                ttl, error = remembered
+                self.entries.set(key, (None, error, 0), ttl=ttl)
+            # a failed refresh leaves the stale entry to be served
+            future.set_exception(ex)
+        else:
+            self.entries.set(key, (value, None, time.monotonic() + self.ttl),
+                             ttl=self.ttl + self.stale)
+            future.set_result(value)
+        finally:
+            with self.lock:
+                self.loading.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
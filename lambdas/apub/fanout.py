@@ -0,0 +1,82 @@
+"""Bounded-concurrency delivery of activities to remote inboxes."""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+from urllib import parse
+
+import log
+import config
+import metrics
+from apub import http
+
+logger = log.get('fanout')
+
+
+def _deliver_one(index, inbox, body):
+    try:
+        return index, {'inbox': inbox, 'ok': True,
+                       'response': http.post(inbox, body)}
+    except Exception as ex:
+        logger.warning('delivery to %s failed: %r', inbox, ex,
+                       exc_info=log.verbose(logger))
+        return index, {'inbox': inbox, 'ok': False, 'error': repr(ex),
+                       'status': getattr(ex, 'code', None)}
+
+
+def deliver(jobs, max_workers=None, per_host=None, stop_at=None):
+    """Deliver each `(inbox, body)` job, returning per-inbox results.
+
+    At most `max_workers` requests are in flight overall and at most
+    `per_host` against any single remote host, so a slow instance only
+    ties up its own share of the workers. Results are returned in the
+    same order as `jobs`; a failure is recorded in its result (with
+    the HTTP status, if there was one) rather than raised.
+
+    No more jobs are started once `time.monotonic()` passes `stop_at`;
+    those left over have a result of None.
+
+    >>> deliver([])
+    []
+    >>> deliver([('https://a.local/inbox', b'{}')], stop_at=0)
+    [None]
+
+    """
+    max_workers = max_workers or config.DELIVERY_CONCURRENCY
+    per_host = per_host or config.DELIVERY_PER_HOST
+
+    results = [None] * len(jobs)
+    if not jobs:
+        return results
+
+    pending = {}
+    for index, (inbox, body) in enumerate(jobs):
+        host = parse.urlparse(inbox).netloc
+        pending.setdefault(host, deque()).append((index, inbox, body))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = {}
+        active = dict.fromkeys(pending, 0)
+
+        def fill(host):
+            queue = pending[host]
+            if stop_at is not None and time.monotonic() >= stop_at:
+                return
+            while queue and active[host] < per_host:
+                in_flight[pool.submit(_deliver_one, *queue.popleft())] = host
+                active[host] += 1
+
+        for host in pending:
+            fill(host)
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                host = in_flight.pop(future)
+                active[host] -= 1
+                index, result = future.result()
+                results[index] = result
+                metrics.count('delivered' if result['ok']
+                              else 'delivery_failed')
+                fill(host)
+
+    return results
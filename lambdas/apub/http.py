@@ -1,52 +1,163 @@
+import io
 import json
 import time
 import base64
 import hashlib
+import http.client
 from datetime import datetime
-from urllib import request, parse
+from urllib import parse
 from urllib.error import HTTPError
 
-from apub import signatures, utils
+import log
+import config
+import metrics
+from apub import breaker, signatures, utils
+from apub.cache import FetchCache
+from apub.pool import ConnectionPool
+
+logger = log.get('http')
+
+POOL = ConnectionPool()
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+_deadline = None
+
+
+def set_deadline(context):
+    """Bound outbound requests by the Lambda invocation's remaining time.
+
+    Call at the start of each invocation; a context of None (as in
+    tests) removes the bound.
+    """
+    global _deadline
+    _deadline = None
+    if context is not None:
+        _deadline = (time.monotonic() - config.DEADLINE_MARGIN +
+                     context.get_remaining_time_in_millis() / 1000)
+
+
+def remaining():
+    """Seconds left before the invocation deadline, or None if unbounded."""
+    if _deadline is None:
+        return None
+    return _deadline - time.monotonic()
+
+
+def _timeout():
+    if _deadline is None:
+        return None
+    remaining = _deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError('invocation deadline reached')
+    return remaining
+
+
+def _send(method, url, data, headers):
+    host = parse.urlsplit(url).hostname
+    timeout = _timeout()
+    try:
+        probe = breaker.check(host)
+    except breaker.CircuitOpen:
+        metrics.count('circuit_open')
+        raise
+    try:
+        with metrics.span(method.lower(), host=host):
+            response = POOL.request(method, url, body=data, headers=headers,
+                                    timeout=timeout)
+    except (OSError, http.client.HTTPException):
+        metrics.host_failure(host)
+        breaker.failure(host)
+        raise
+    else:
+        if response.status >= 400:
+            metrics.host_failure(host)
+        if response.status >= 500:
+            breaker.failure(host)
+        else:
+            breaker.success(host)
+    finally:
+        if probe:
+            breaker.release(host)
+    return response
+
+
+def request(method, url, data=None, headers=None, max_redirects=5):
+    """Make a request over a pooled connection.
+
+    Raises HTTPError for error statuses, like urllib's urlopen. GETs
+    follow redirects. Requests to hosts whose circuit is open fail
+    straight away with breaker.CircuitOpen.
+    """
+    for _ in range(max_redirects + 1):
+        response = _send(method, url, data, headers)
+        if method == 'GET' and response.status in REDIRECTS:
+            url = parse.urljoin(url, response.headers['Location'])
+            continue
+        break
+
+    if response.status >= 400:
+        raise HTTPError(url, response.status, response.reason,
+                        response.headers, io.BytesIO(response.body))
+    return response
 
 
 def get(url):
     url = utils.trim_frag(url)
-    req = request.Request(url, headers={
-        'Accept': 'application/json',
-        'User-Agent': 'sns-to-activitypub/1',
-    })
     try:
-        response = request.urlopen(req)
-        return json.load(response)
+        response = request('GET', url, headers={
+            'Accept': 'application/json',
+            'User-Agent': 'sns-to-activitypub/1',
+        })
+        return json.loads(response.body)
     except HTTPError as ex:
-        print(ex.headers)
-        print(ex.read())
+        logger.warning('GET %s failed: %s %s', url, ex.code, ex.reason)
+        if log.verbose(logger):
+            logger.debug('response headers: %s', log.Payload(dict(ex.headers)))
+            logger.debug('response body: %s', log.Payload(ex.read()))
         raise
 
 
-GET_CACHE = {}
+def _missing(ex):
+    # deleted actors stay deleted, and missing ones rarely turn up
+    # within a minute
+    if isinstance(ex, HTTPError) and ex.code in (404, 410):
+        url, code, reason = ex.url, ex.code, ex.reason
+        return config.ACTOR_CACHE_MISSING_TTL, lambda: HTTPError(
+            url, code, reason, {}, io.BytesIO()
+        )
+    return None
 
-def get_cached(url, max_age=60.0):
-    """Get, but with extra cache flavor"""
-    url = utils.trim_frag(url)
-    if url in GET_CACHE:
-        if time.time() < GET_CACHE[url]['requested'] + max_age:
-            return GET_CACHE[url]['json']
-
-    response = get(url)
-    GET_CACHE[url] = {
-        'json': response,
-        'requested': time.time()
-    }
-    return response
+
+# `get` is looked up on each load so that it can be patched in tests
+GET_CACHE = FetchCache(lambda url: get(url),
+                       maxsize=config.ACTOR_CACHE_SIZE,
+                       ttl=config.ACTOR_CACHE_TTL,
+                       stale=config.ACTOR_CACHE_STALE,
+                       negative=_missing,
+                       counter=lambda name: metrics.count(
+                           f'actor_cache_{name}'))
+
+def get_cached(url, refresh=False):
+    """Get, through a cache shared by the container's invocations.
+
+    Documents are reused for ACTOR_CACHE_TTL seconds, then served stale
+    while they're refetched for up to ACTOR_CACHE_STALE more. 404 and
+    410 responses are remembered for ACTOR_CACHE_MISSING_TTL. Pass
+    `refresh=True` to go back to the network.
+    """
+    return GET_CACHE.get(utils.trim_frag(url), refresh=refresh)
 
 
 def post(url, body):
-    print('POST to', url)
-    print(json.dumps(body))
+    """Sign and POST an activity to a remote inbox.
+
+    `body` is either the activity or its serialized bytes.
+    """
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    logger.debug('POST body: %s', log.Payload(data))
 
     parsed_url = parse.urlparse(url)
-    data = json.dumps(body).encode()
     sha = hashlib.sha256(data)
     
     headers = {
@@ -58,15 +169,13 @@ def post(url, body):
         'Host': parsed_url.hostname,
     }
     headers = signatures.create_signature_header(headers, parsed_url.path)
-    print(headers)
+    logger.debug('POST headers: %s', log.Payload(headers))
 
-    req = request.Request(url, data=data, headers=headers)
-    response = request.urlopen(req)
-    print(response.status, response.reason)
+    response = request('POST', url, data=data, headers=headers)
+    logger.info('POST to %s: %s %s', url, response.status, response.reason)
     if response.status == 200:
-        r = json.load(response)
-        print('Response:')
-        print(json.dumps(r))
+        r = json.loads(response.body)
+        logger.debug('response: %s', log.Payload(response.body))
         return r
     else:
         return {}
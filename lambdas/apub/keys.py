@@ -0,0 +1,83 @@
+"""Cache of remote actors' public keys for signature verification.
+
+Keys are held in an in-process LRU for the life of the container and,
+when a state table is configured, in DynamoDB so that other containers
+can skip the fetch too. Actors that answered 410 Gone are remembered
+as well, since deleted accounts keep sending us Delete activities.
+"""
+from urllib.error import HTTPError
+
+import config
+import dynamo
+import metrics
+from apub import http, utils
+from apub.cache import LRUCache
+
+GONE = 'gone'
+
+MEMORY = LRUCache(maxsize=config.KEY_CACHE_SIZE, ttl=config.KEY_CACHE_TTL)
+
+
+class ActorGone(Exception):
+    pass
+
+
+def _load(pem):
+    from cryptography.hazmat.primitives import serialization
+
+    if pem == GONE:
+        return GONE
+    return serialization.load_pem_public_key(pem.encode())
+
+
+def fetch(key_id):
+    """Fetch the actor owning `key_id` and cache its public key.
+
+    The actor document always comes from the network, since the key is
+    reported as fresh, but it's kept by http.get_cached so that a Follow
+    from the same actor doesn't fetch it again.
+    """
+    url = utils.trim_frag(key_id)
+    try:
+        with metrics.span('key_fetch'):
+            pem = http.get_cached(url, refresh=True)['publicKey'][
+                'publicKeyPem']
+    except HTTPError as ex:
+        if ex.code != 410:
+            raise
+        pem = GONE
+
+    key = _load(pem)
+    MEMORY.set(url, key)
+    dynamo.put_state({'id': f'key#{url}', 'pem': pem},
+                     ttl=config.KEY_STORE_TTL)
+    return key
+
+
+def get(key_id, refresh=False):
+    """Return `(public_key, cached)` for the actor owning `key_id`.
+
+    `cached` tells the caller whether the key came from a cache and so
+    might be stale. Pass `refresh=True` to skip the caches, e.g. after
+    a cached key failed to verify because the actor rotated it.
+
+    Raises ActorGone if the actor has been deleted.
+    """
+    url = utils.trim_frag(key_id)
+    key, cached = None, False
+    if not refresh:
+        key = MEMORY.get(url)
+        if key is None:
+            item = dynamo.get_state(f'key#{url}')
+            if item is not None:
+                key = _load(item['pem'])
+                MEMORY.set(url, key)
+        cached = key is not None
+        metrics.count('key_cache_hit' if cached else 'key_cache_miss')
+
+    if key is None:
+        key = fetch(url)
+
+    if key is GONE:
+        raise ActorGone(url)
+    return key, cached
@@ -0,0 +1,154 @@
+"""Persistent HTTP/1.1 connections to remote servers.
+
+Connections are kept per (scheme, host, port) and reused across
+requests and warm invocations, so talking to the same instance again
+skips the TCP and TLS handshakes. Where a new connection is needed,
+the last TLS session negotiated with that host is offered for
+resumption.
+"""
+import ssl
+import time
+import threading
+import http.client
+from urllib import parse
+
+import config
+
+
+class Response:
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    """An HTTPS connection which resumes the pool's TLS sessions."""
+    def __init__(self, host, port, pool, **kwargs):
+        super().__init__(host, port, context=pool.ssl_context(), **kwargs)
+        self.pool = pool
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock,
+            server_hostname=self.host,
+            session=self.pool.sessions.get(self.host)
+        )
+
+
+class ConnectionPool:
+    def __init__(self, max_idle_per_host=None, idle_timeout=None,
+                 connect_timeout=None, read_timeout=None):
+        self.max_idle_per_host = max_idle_per_host or config.HTTP_POOL_SIZE
+        self.idle_timeout = idle_timeout or config.HTTP_IDLE_TIMEOUT
+        self.connect_timeout = connect_timeout or config.HTTP_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or config.HTTP_READ_TIMEOUT
+        self._ssl_context = None
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.sessions = {}
+        self.connections_opened = 0
+
+    def ssl_context(self):
+        # loading the CA bundle is slow, so only do it once we actually
+        # need to make an HTTPS connection
+        with self.lock:
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return self._ssl_context
+
+    def _checkout(self, key):
+        """Return an idle connection for `key`, or None."""
+        now = time.monotonic()
+        with self.lock:
+            idle = self.idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return conn
+                conn.close()
+        return None
+
+    def _checkin(self, key, conn):
+        if isinstance(conn, _HTTPSConnection) and conn.sock is not None:
+            # TLS 1.3 tickets only turn up after the handshake, so
+            # pick up the session once a response has been read
+            self.sessions[conn.host] = conn.sock.session
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def _connect(self, scheme, host, port, timeout=None):
+        connect_timeout = self.connect_timeout
+        if timeout is not None:
+            connect_timeout = min(connect_timeout, timeout)
+        if scheme == 'https':
+            conn = _HTTPSConnection(host, port, self,
+                                    timeout=connect_timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port,
+                                              timeout=connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        with self.lock:
+            self.connections_opened += 1
+        return conn
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """Make a request, returning a Response with the body read in.
+
+        `timeout` caps both the connect and read timeouts for this
+        request.
+
+        A reused connection that turns out to have been closed by the
+        server is replaced and the request sent once more.
+        """
+        parsed = parse.urlsplit(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        target = parsed.path or '/'
+        if parsed.query:
+            target += '?' + parsed.query
+
+        conn = self._checkout(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect(*key, timeout=timeout)
+            if timeout is not None:
+                conn.sock.settimeout(min(timeout, self.read_timeout))
+            try:
+                conn.request(method, target, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                conn, reused = None, False
+                continue
+            except Exception:
+                conn.close()
+                raise
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            conn.sock.settimeout(self.read_timeout)
+            self._checkin(key, conn)
+
+        return Response(response.status, response.reason, response.headers,
+                        data)
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self.idle.clear()
@@ -1,31 +1,142 @@
 import os
 import re
 import json
-import boto3
 import base64
 import hashlib
-import traceback
+import threading
 from datetime import datetime
 from urllib import request
-from urllib.error import HTTPError
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.exceptions import InvalidSignature
 
+import aws
+import log
 import config
-from apub import http, utils
+import metrics
+from apub import keys, utils
 from apig_http import responses
 
-kms = boto3.client('kms')
+# cryptography is imported where it's used, so that routes which never
+# sign or verify don't pay for loading it
+
+logger = log.get('signatures')
+
+kms = None
+
+
+def _kms():
+    return kms or aws.client('kms')
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+class KeyFetchFailed(InvalidSignature):
+    """The signer's key couldn't be fetched, which may be temporary."""
+
+
+class KmsSigner:
+    """Signs with the KMS asymmetric key named by KEY_ID.
+
+    Every signature is a KMS API call, but the private key never
+    leaves KMS.
+    """
+    def public_key_pem(self):
+        from cryptography.hazmat.primitives import serialization
+
+        response = _kms().get_public_key(KeyId=os.environ['KEY_ID'])
+        key = serialization.load_der_public_key(response['PublicKey'])
+        return key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+
+    def sign(self, message):
+        response = _kms().sign(
+            KeyId=os.environ['KEY_ID'],
+            Message=message,
+            MessageType='RAW',
+            SigningAlgorithm='RSASSA_PKCS1_V1_5_SHA_256'
+        )
+        return response['Signature']
+
+
+class LocalSigner:
+    """Signs in-process with an envelope-encrypted RSA private key.
+
+    LOCAL_SIGNING_DATA_KEY holds a KMS-encrypted AES-256 data key and
+    LOCAL_SIGNING_KEY the PEM private key sealed with it by
+    `seal_private_key`, both base64 encoded. The key is unwrapped with
+    a single KMS Decrypt when the signer is created, after which
+    signing costs no network calls.
+    """
+    def __init__(self, sealed_key=None, data_key=None):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        sealed_key = base64.b64decode(
+            sealed_key or os.environ['LOCAL_SIGNING_KEY']
+        )
+        data_key = _kms().decrypt(CiphertextBlob=base64.b64decode(
+            data_key or os.environ['LOCAL_SIGNING_DATA_KEY']
+        ))['Plaintext']
+        pem = AESGCM(data_key).decrypt(sealed_key[:12], sealed_key[12:], None)
+        self.private_key = serialization.load_pem_private_key(pem, None)
+
+    def public_key_pem(self):
+        from cryptography.hazmat.primitives import serialization
+
+        return self.private_key.public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+
+    def sign(self, message):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        return self.private_key.sign(message, padding.PKCS1v15(),
+                                     hashes.SHA256())
+
+
+def seal_private_key(pem, key_id):
+    """Envelope-encrypt a PEM private key for use by `LocalSigner`.
+
+    Returns the `(sealed_key, data_key)` pair, base64 encoded, to be
+    set as LOCAL_SIGNING_KEY and LOCAL_SIGNING_DATA_KEY.
+    """
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    response = _kms().generate_data_key(KeyId=key_id, KeySpec='AES_256')
+    nonce = os.urandom(12)
+    sealed = nonce + AESGCM(response['Plaintext']).encrypt(nonce, pem, None)
+    return (base64.b64encode(sealed).decode(),
+            base64.b64encode(response['CiphertextBlob']).decode())
+
+
+SIGNERS = {
+    'kms': KmsSigner,
+    'local': LocalSigner,
+}
+
+_signer = None
+_signer_lock = threading.Lock()
+
+def get_signer():
+    """Return the signer selected by config.SIGNING_BACKEND.
+
+    The signer is created once and reused for the life of the
+    container, even when the first deliveries start at once.
+    """
+    global _signer
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                _signer = SIGNERS[config.SIGNING_BACKEND]()
+    return _signer
 
 
 def get_public_key():
-    response = kms.get_public_key(KeyId=os.environ['KEY_ID'])
-    key = serialization.load_der_public_key(response['PublicKey'])
-    return key.public_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo
-    ).decode()
+    return get_signer().public_key_pem()
 
 
 def create_signature_header(headers, target, method="post"):
@@ -41,13 +152,10 @@ def create_signature_header(headers, target, method="post"):
             
     to_be_signed = "\n".join(to_be_signed)
 
-    response = kms.sign(
-        KeyId=os.environ['KEY_ID'],
-        Message=to_be_signed.encode(),
-        MessageType='RAW',
-        SigningAlgorithm='RSASSA_PKCS1_V1_5_SHA_256'
-    )
-    signature = base64.b64encode(response['Signature']).decode()
+    with metrics.span('sign'):
+        signature = base64.b64encode(
+            get_signer().sign(to_be_signed.encode())
+        ).decode()
 
     new_headers = headers.copy()
     new_headers['Signature'] = (
@@ -58,7 +166,29 @@ def create_signature_header(headers, target, method="post"):
     return new_headers
 
 
-def verify_headers(headers, request_target, method="post", digest=None):
+def _verify(key, signature, message):
+    from cryptography.exceptions import InvalidSignature as BadSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    try:
+        key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+    except BadSignature as ex:
+        raise InvalidSignature('signature does not match') from ex
+
+
+def body_digest(body):
+    """Compute the Digest header value for a request body.
+
+    >>> body_digest('hello world')
+    'SHA-256=uU0nuZNNPgilLlLX2n2r+sSE7+N6U4DukIj3rOLvzek='
+
+    """
+    sha = hashlib.sha256(body.encode())
+    return f'SHA-256={base64.b64encode(sha.digest()).decode()}'
+
+
+def parse_signature(headers):
     if 'signature' not in headers:
         raise InvalidSignature('missing signature header')
 
@@ -71,6 +201,45 @@ def verify_headers(headers, request_target, method="post", digest=None):
 
     if 'keyId' not in sig_parts or 'headers' not in sig_parts:
         raise InvalidSignature('missing keyId or headers in signature header')
+    return sig_parts
+
+
+def check_date(value):
+    """Make sure a signed Date header is recent."""
+    try:
+        sent_date = datetime.strptime(value, '%a, %d %b %Y %H:%M:%S GMT')
+    except (TypeError, ValueError):
+        raise InvalidSignature('unrecognized date format - expecting'
+                               ' "Thu, 01 Jan 1970 00:00:00 GMT"')
+    delta = datetime.utcnow() - sent_date
+    if delta.total_seconds() > (15 * 60):
+        raise InvalidSignature('message is too old')
+    if delta.total_seconds() < -5:
+        raise InvalidSignature('message came from the future')
+
+
+def precheck(headers, body):
+    """Cheap checks of a signed request, without verifying the signature.
+
+    Checks the signature header is well formed, the signed date is
+    recent and the body matches its digest. Returns the keyId.
+    """
+    sig_parts = parse_signature(headers)
+    signed = sig_parts['headers'].split()
+    if 'date' in signed:
+        check_date(headers.get('date'))
+    if 'digest' in headers:
+        algorithm, _, value = headers['digest'].partition('=')
+        if algorithm.upper() != 'SHA-256' or \
+                f'SHA-256={value}' != body_digest(body):
+            raise InvalidSignature('digest does not match body')
+    elif 'digest' in signed:
+        raise InvalidSignature('missing header digest')
+    return sig_parts['keyId']
+
+
+def verify_headers(headers, request_target, method="post", digest=None):
+    sig_parts = parse_signature(headers)
 
     # construct the putative message
     message_parts = []
@@ -83,17 +252,7 @@ def verify_headers(headers, request_target, method="post", digest=None):
             message_parts.append(f'digest: {digest}')
         elif signed_header_name == 'date':
             # verify the date is recent
-            try:
-                sent_date = datetime.strptime(headers['date'],
-                                              '%a, %d %b %Y %H:%M:%S GMT')
-                delta = datetime.utcnow() - sent_date
-                if delta.total_seconds() > (15 * 60):
-                    raise InvalidSignature('message is too old')
-                if delta.total_seconds() < -5:
-                    raise InvalidSignature('message came from the future')
-            except ValueError:
-                raise InvalidSignature('unrecognized date format - expecting'
-                                       ' "Thu, 01 Jan 1970 00:00:00 GMT"')
+            check_date(headers.get('date'))
             message_parts.append(f'date: {headers[signed_header_name]}')
         else:
             try:
@@ -104,30 +263,31 @@ def verify_headers(headers, request_target, method="post", digest=None):
                 raise InvalidSignature('missing header ' + signed_header_name)
             
     message = "\n".join(message_parts)
-    print(repr(message))
+    logger.debug('signed string: %s', log.Payload(message))
     
     # retrieve the public key
     try:
-        actor = http.get(sig_parts['keyId'])
-        key = serialization.load_pem_public_key(
-            actor['publicKey']['publicKeyPem'].encode()
-        )
-    except HTTPError as ex:
-        if ex.code == 410:
-            # Gone - we're probably processing a delete
-            # it would be nice to verify that, but sadly we can't.
-            return utils.trim_frag(sig_parts['keyId'])
-        raise InvalidSignature('failed getting remote pubkey') from ex
+        key, cached = keys.get(sig_parts['keyId'])
+    except keys.ActorGone:
+        # Gone - we're probably processing a delete
+        # it would be nice to verify that, but sadly we can't.
+        return utils.trim_frag(sig_parts['keyId'])
     except Exception as ex:
-        raise InvalidSignature('failed getting remote pubkey') from ex
+        raise KeyFetchFailed('failed getting remote pubkey') from ex
     
     # verify
-    key.verify(
-        base64.b64decode(sig_parts['signature']),
-        message.encode(),
-        padding.PKCS1v15(),
-        hashes.SHA256()
-    )
+    signature = base64.b64decode(sig_parts['signature'])
+    try:
+        _verify(key, signature, message.encode())
+    except InvalidSignature:
+        if not cached:
+            raise
+        # the actor may have rotated their key since we cached it
+        try:
+            key, _ = keys.get(sig_parts['keyId'], refresh=True)
+        except Exception as ex:
+            raise KeyFetchFailed('failed getting remote pubkey') from ex
+        _verify(key, signature, message.encode())
 
     # return actor
     return utils.trim_frag(sig_parts['keyId'])
@@ -135,15 +295,15 @@ def verify_headers(headers, request_target, method="post", digest=None):
 def wrapped_verify_headers(func):
     def _verify(event, context):
         try:
-            sha = hashlib.sha256(event.get('body', '').encode())
             event['actor'] = verify_headers(
                 event['headers'],
                 event['requestContext']['http']['path'],
                 method=event['requestContext']['http']['method'].lower(),
-                digest=f'SHA-256={base64.b64encode(sha.digest()).decode()}'
+                digest=body_digest(event.get('body', ''))
             )
         except InvalidSignature as ex:
-            traceback.print_exc()
+            logger.info('rejected request signature: %s', ex,
+                        exc_info=log.verbose(logger))
             return responses.HttpResponse('Invalid HTTP signature', 403)
 
         return func(event, context)
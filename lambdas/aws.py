@@ -0,0 +1,18 @@
+"""AWS clients, created on first use.
+
+Importing boto3 and building a client takes a good part of a cold
+start, so nothing should do it at import time: a route or record that
+never touches an AWS service shouldn't pay for it.
+"""
+import threading
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def client(service):
+    with _lock:
+        if service not in _clients:
+            import boto3
+            _clients[service] = boto3.client(service)
+        return _clients[service]
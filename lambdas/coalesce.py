@@ -0,0 +1,115 @@
+"""Gathers bursts of repeated alerts into digests.
+
+A flapping alarm can publish many alerts a minute, each of which would
+otherwise be sent to every follower. Alerts are grouped by alarm name,
+or failing that a fingerprint of the message. The first alert of a
+group is sent straight away and opens a COALESCE_WINDOW second window
+in the state table; repeats within it are only counted, keeping the
+latest. When the window closes the repeats go out as one digest.
+
+Closing is scheduled with a delayed message on the delivery queue,
+which names the window by when it opened, so that a late message can't
+close the window after it. Without a queue, or if the message is lost,
+a window is closed by the next alert of its group instead.
+"""
+import re
+import html
+import json
+import hashlib
+
+import log
+import config
+import dynamo
+import formatters
+
+logger = log.get('coalesce')
+
+PREFIX = 'coalesce#'
+
+# SQS won't delay a message for longer
+MAX_DELAY = 900
+
+# tries at opening or joining a window, which another sender may be
+# opening or closing at the same time
+ATTEMPTS = 3
+
+
+def key(text):
+    """Group an alert by its alarm name, or by its text less any numbers.
+
+    >>> key('{"AlarmName": "api-errors", "NewStateValue": "ALARM"}')
+    'alarm:api-errors'
+    >>> key('disk 91% full') == key('disk 93% full')
+    True
+
+    """
+    try:
+        msg = json.loads(text)
+        if isinstance(msg, dict) and 'AlarmName' in msg:
+            return 'alarm:' + msg['AlarmName']
+    except ValueError:
+        pass
+    return hashlib.sha256(re.sub(r'\d+', '', text).encode()).hexdigest()[:16]
+
+
+def admit(text, timestamp, queue=None, message_id=None):
+    """Decide whether an alert should be sent now.
+
+    Returns that, along with the digest of an earlier window of the
+    same group that closed without being flushed, if any. An alert
+    that can't be settled either way is sent, as is a retry of the one
+    that opened the window (`message_id` being its SNS MessageId).
+    """
+    id = PREFIX + key(text)
+    overdue = digest(dynamo.take_state(id, expired_only=True))
+    opener = {'opened_by': message_id} if message_id else {}
+    for _ in range(ATTEMPTS):
+        if dynamo.claim_state(id, config.COALESCE_WINDOW, count=0,
+                              first_at=timestamp, **opener):
+            if queue is not None and dynamo.state_enabled():
+                queue.send(json.dumps({'flush': id, 'first_at': timestamp}),
+                           delay=min(config.COALESCE_WINDOW, MAX_DELAY))
+            return True, overdue
+        window = message_id and dynamo.get_state(id)
+        if window and window.get('opened_by') == message_id:
+            return True, overdue
+        if dynamo.increment_state(id, values={
+            'latest': text, 'latest_at': timestamp
+        }, existing=True, count=1) is not None:
+            return False, overdue
+        # the window was flushed in between - start another
+    logger.warning('could not coalesce %s, sending it', id)
+    return True, overdue
+
+
+def flush(id, first_at=None):
+    """Close a window, returning its digest if there were repeats.
+
+    Only the window opened at `first_at` is closed; without it (as in
+    messages queued before windows were named), only an expired one.
+    """
+    if first_at is None:
+        return digest(dynamo.take_state(id, expired_only=True))
+    return digest(dynamo.take_state(id, only_if={'first_at': first_at}))
+
+
+def digest(window):
+    """Build the HTML content summing up a window's repeated alerts.
+
+    >>> print(digest({'count': 2, 'first_at': '2023-10-04T21:41:53Z',
+    ...               'latest_at': '2023-10-04T21:44:01Z',
+    ...               'latest': 'disk 93% full'}))
+    <p>2 more alerts since 2023-10-04T21:41:53Z, the latest at 2023-10-04T21:44:01Z:</p>
+    <p>disk 93% full</p>
+    >>> digest({'count': 0}) is None
+    True
+
+    """
+    if not window or not window.get('count'):
+        return None
+    count = window['count']
+    summary = html.escape(
+        f"{count} more alert{'s' if count > 1 else ''} since "
+        f"{window['first_at']}, the latest at {window['latest_at']}:"
+    )
+    return f'<p>{summary}</p>\n' + formatters.format_message(window['latest'])
@@ -11,6 +11,98 @@ ACTOR = BASEURL + ACTOR_PATH
 ACTOR_INBOX = f'{ACTOR}/inbox'
 ACTOR_INBOX_PATH = f'{ACTOR_PATH}/inbox'
 ACTOR_FOLLOWERS = f'{ACTOR}/followers'
+ACTOR_FOLLOWERS_PATH = f'{ACTOR_PATH}/followers'
 
 if 'FOLLOWER_ALLOW_LIST' in os.environ:
     FOLLOWERS = os.environ['FOLLOWER_ALLOW_LIST'].split(',')
+
+# outbound delivery limits: overall in-flight requests, and per remote host
+DELIVERY_CONCURRENCY = int(os.environ.get('DELIVERY_CONCURRENCY', '16'))
+DELIVERY_PER_HOST = int(os.environ.get('DELIVERY_PER_HOST', '4'))
+
+# how outbound requests are signed: 'kms' or 'local' (see apub.signatures)
+SIGNING_BACKEND = os.environ.get('SIGNING_BACKEND', 'kms')
+
+# remote public keys: in-memory cache size and lifetime, and how long
+# they're kept in the state table
+KEY_CACHE_SIZE = int(os.environ.get('KEY_CACHE_SIZE', '512'))
+KEY_CACHE_TTL = int(os.environ.get('KEY_CACHE_TTL', '3600'))
+KEY_STORE_TTL = int(os.environ.get('KEY_STORE_TTL', '86400'))
+
+# number of parallel segments used when scanning the follower table
+FOLLOWER_SCAN_SEGMENTS = int(os.environ.get('FOLLOWER_SCAN_SEGMENTS', '4'))
+
+# queued delivery retries: attempts before giving up, and the backoff
+# between them in seconds
+DELIVERY_MAX_ATTEMPTS = int(os.environ.get('DELIVERY_MAX_ATTEMPTS', '8'))
+DELIVERY_BACKOFF_BASE = int(os.environ.get('DELIVERY_BACKOFF_BASE', '30'))
+DELIVERY_BACKOFF_MAX = int(os.environ.get('DELIVERY_BACKOFF_MAX', '3600'))
+
+# outbound HTTP: timeouts in seconds, and the idle keep-alive
+# connections kept per remote host
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '15'))
+HTTP_IDLE_TIMEOUT = float(os.environ.get('HTTP_IDLE_TIMEOUT', '30'))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '8'))
+
+# circuit breaker: consecutive failures before a host is skipped, how
+# long it's skipped for, and how often containers reread shared state
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN = int(os.environ.get('BREAKER_COOLDOWN', '300'))
+BREAKER_REFRESH = int(os.environ.get('BREAKER_REFRESH', '60'))
+
+# seconds of an invocation's remaining time kept back from outbound
+# request timeouts, so there's time left to record the results
+DEADLINE_MARGIN = float(os.environ.get('DEADLINE_MARGIN', '2'))
+
+# incoming activities from different actors handled at once per batch
+INCOMING_CONCURRENCY = int(os.environ.get('INCOMING_CONCURRENCY', '10'))
+
+# how the inbox accepts activities: 'verify' checks the HTTP signature
+# before queueing, 'defer' queues after cheap checks and leaves the
+# signature to the incoming worker. Requests whose queued message
+# would be larger than SQS's 256 KiB limit are refused.
+INBOX_MODE = os.environ.get('INBOX_MODE', 'verify')
+INBOX_MAX_BYTES = int(os.environ.get('INBOX_MAX_BYTES', '262144'))
+
+# idempotent incoming processing: how long an activity id is remembered
+# once handled, how long a claim lasts while it's being handled, and
+# the ids each container remembers locally
+PROCESSED_TTL = int(os.environ.get('PROCESSED_TTL', '604800'))
+PROCESSED_LEASE = int(os.environ.get('PROCESSED_LEASE', '300'))
+PROCESSED_CACHE_SIZE = int(os.environ.get('PROCESSED_CACHE_SIZE', '4096'))
+
+# the public followers collection: actors per page, and how long
+# clients may cache it for in seconds
+FOLLOWERS_PAGE_SIZE = int(os.environ.get('FOLLOWERS_PAGE_SIZE', '50'))
+FOLLOWERS_MAX_AGE = int(os.environ.get('FOLLOWERS_MAX_AGE', '300'))
+
+# published posts: how long clients may cache them in seconds, and how
+# many each container keeps in memory
+OBJECT_MAX_AGE = int(os.environ.get('OBJECT_MAX_AGE', '31536000'))
+OBJECT_CACHE_SIZE = int(os.environ.get('OBJECT_CACHE_SIZE', '256'))
+
+# checkpointed fan-out: seconds of an invocation kept back for saving
+# progress and handing over to a continuation (at most a quarter of
+# the time the invocation has left), recipients handled
+# between checkpoints, how long progress is kept, and how many times
+# a message can be continued
+FANOUT_RESERVE = float(os.environ.get('FANOUT_RESERVE', '20'))
+FANOUT_CHECKPOINT_EVERY = int(os.environ.get('FANOUT_CHECKPOINT_EVERY',
+                                             '500'))
+FANOUT_PROGRESS_TTL = int(os.environ.get('FANOUT_PROGRESS_TTL', '86400'))
+FANOUT_MAX_CONTINUATIONS = int(os.environ.get('FANOUT_MAX_CONTINUATIONS',
+                                              '10'))
+
+# seconds over which repeats of an alert are gathered into one digest
+# after the first is sent; 0 sends every alert as it comes
+COALESCE_WINDOW = int(os.environ.get('COALESCE_WINDOW', '300'))
+
+# remote actor documents: how many each container keeps, how long
+# they're used for in seconds, how much longer they may be served
+# while being refetched, and how long a 404 or 410 is remembered
+ACTOR_CACHE_SIZE = int(os.environ.get('ACTOR_CACHE_SIZE', '1024'))
+ACTOR_CACHE_TTL = int(os.environ.get('ACTOR_CACHE_TTL', '300'))
+ACTOR_CACHE_STALE = int(os.environ.get('ACTOR_CACHE_STALE', '3600'))
+ACTOR_CACHE_MISSING_TTL = int(os.environ.get('ACTOR_CACHE_MISSING_TTL',
+                                             '60'))
@@ -0,0 +1,124 @@
+"""Delivery worker: posts queued activities to remote inboxes.
+
+sender.handler plans each SNS message into one job per inbox on the
+delivery queue; this handler consumes those jobs in batches. Failed
+jobs are retried with exponential backoff by stretching the message's
+visibility timeout, and reported back individually so the rest of the
+batch is deleted.
+
+The queue also carries delayed messages closing alert coalescing
+windows (see coalesce), whose digests are planned and queued here.
+"""
+import json
+import random
+
+import log
+import metrics
+import config
+import queues
+import coalesce
+import followers
+import apub.http
+import apub.fanout
+
+logger = log.get('delivery')
+
+
+def job(inbox, payload):
+    """Serialize a delivery job for the queue.
+
+    `payload` is the already serialized activity, which is posted
+    as-is.
+    """
+    return json.dumps({'inbox': inbox, 'body': payload.decode()})
+
+
+def retryable(result):
+    """Whether a failed delivery is worth trying again.
+
+    Client errors other than timeouts and rate limiting won't go away
+    by themselves.
+
+    >>> retryable({'status': None}), retryable({'status': 503})
+    (True, True)
+    >>> retryable({'status': 429}), retryable({'status': 410})
+    (True, False)
+
+    """
+    status = result.get('status')
+    return status is None or status >= 500 or status in (408, 429)
+
+
+def backoff(attempt):
+    """Seconds to wait before the given (1-based) retry, with jitter."""
+    delay = min(config.DELIVERY_BACKOFF_BASE * 2 ** (attempt - 1),
+                config.DELIVERY_BACKOFF_MAX)
+    return int(delay / 2 + random.uniform(0, delay / 2))
+
+
+def flush(window_id, first_at=None, queue=None):
+    """Send the digest of a closed coalescing window, if it has one."""
+    # imported here since sender imports this module
+    import sender
+
+    content = coalesce.flush(window_id, first_at)
+    if content is None:
+        return
+    record = sender.digest_record(content)
+    jobs = sender.plan(sender.sns_to_post(record), 'alert',
+                       followers.snapshot())
+    logger.info('sending digest of %s', window_id)
+    if queue is not None:
+        sender.fan_out(record['Sns']['MessageId'], jobs, queue)
+    else:
+        apub.fanout.deliver(jobs)
+
+
+@metrics.instrument('delivery')
+def handler(event, context, queue=None):
+    apub.http.set_deadline(context)
+    queue = queue or queues.delivery_queue()
+    r = {'batchItemFailures': []}
+
+    records = []
+    jobs = []
+    for record in event['Records']:
+        body = json.loads(record['body'])
+        if 'flush' not in body:
+            records.append(record)
+            jobs.append(body)
+            continue
+        try:
+            flush(body['flush'], body.get('first_at'), queue)
+        except Exception:
+            logger.exception('failed flushing %s', body['flush'])
+            r['batchItemFailures'].append({
+                'itemIdentifier': record['messageId']
+            })
+
+    results = apub.fanout.deliver([
+        # jobs queued before payloads were serialized by the planner
+        # carry the activity itself
+        (job['inbox'], job['body'].encode() if 'body' in job
+         else job['activity'])
+        for job in jobs
+    ])
+
+    for record, result in zip(records, results):
+        if result['ok']:
+            continue
+
+        attempt = int(record['attributes']['ApproximateReceiveCount'])
+        if not retryable(result) or attempt >= config.DELIVERY_MAX_ATTEMPTS:
+            logger.warning('giving up on delivery to %s after %d attempts: %s',
+                           result['inbox'], attempt, result['error'])
+            continue
+
+        logger.info('delivery to %s failed, retrying: %s', result['inbox'],
+                    result['error'])
+        if queue is not None:
+            queue.retry_later(record, backoff(attempt))
+        r['batchItemFailures'].append({
+            'itemIdentifier': record['messageId']
+        })
+    return r
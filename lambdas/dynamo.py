@@ -1,29 +1,382 @@
 import os
-import boto3
+import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
-dyn = boto3.client('dynamodb')
+import aws
+import metrics
 
+dyn = None
 
-def put(item):
+
+def _dyn():
+    return dyn or aws.client('dynamodb')
+
+
+def _encode(value):
+    if isinstance(value, (set, frozenset)):
+        return {'SS': sorted(value)}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float)):
+        return {'N': str(value)}
+    return {'S': value}
+
+
+def _decode(value):
+    """Turn a DynamoDB attribute value back into a Python value.
+
+    >>> _decode({'S': 'foo'}), _decode({'N': '3'}), _decode({'BOOL': True})
+    ('foo', 3, True)
+    >>> _decode({'SS': ['a', 'b']}) == {'a', 'b'}
+    True
+
+    """
+    if 'SS' in value:
+        return set(value['SS'])
+    if 'N' in value:
+        n = value['N']
+        return float(n) if '.' in n else int(n)
+    if 'BOOL' in value:
+        return value['BOOL']
+    return value['S']
+
+
+def put(item, unless_same=()):
+    """Store a follower.
+
+    Returns True if it's new and False if it replaced a stored one.
+    With `unless_same`, a stored follower whose values for those
+    attributes already match is left alone, and None is returned.
+    """
     formatted_item = {
         k: {'S': v} for k, v in item.items()
     }
-    return dyn.put_item(
-        TableName=os.environ['TABLE_NAME'],
-        Item=formatted_item
-    )
+    kwargs = {}
+    if unless_same:
+        kwargs = {
+            'ConditionExpression': ' OR '.join(['attribute_not_exists(id)'] + [
+                f'#u{i} <> :u{i}' for i in range(len(unless_same))
+            ]),
+            'ExpressionAttributeNames': {
+                f'#u{i}': name for i, name in enumerate(unless_same)
+            },
+            'ExpressionAttributeValues': {
+                f':u{i}': formatted_item[name]
+                for i, name in enumerate(unless_same)
+            },
+        }
+    try:
+        response = _dyn().put_item(
+            TableName=os.environ['TABLE_NAME'],
+            Item=formatted_item,
+            ReturnValues='ALL_OLD',
+            **kwargs
+        )
+    except _dyn().exceptions.ConditionalCheckFailedException:
+        return None
+    return 'Attributes' not in response
+
+
+def _scan(table_name, segment=0, total_segments=1):
+    kwargs = {'TableName': table_name}
+    if total_segments > 1:
+        kwargs.update(Segment=segment, TotalSegments=total_segments)
+    while True:
+        response = _dyn().scan(**kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
 
+def list(segments=1):
+    """Yield every item in the table, following scan pagination.
 
-def list():
-    response = dyn.scan(TableName=os.environ['TABLE_NAME'])
-    for item in response['Items']:
+    With `segments` > 1 the table is read as a parallel scan, one
+    thread per segment.
+    """
+    table_name = os.environ['TABLE_NAME']
+    with metrics.span('follower_scan'):
+        if segments > 1:
+            with ThreadPoolExecutor(max_workers=segments) as pool:
+                items = itertools.chain.from_iterable(pool.map(
+                    lambda segment: [*_scan(table_name, segment, segments)],
+                    range(segments)
+                ))
+        else:
+            items = [*_scan(table_name)]
+
+    for item in items:
         yield {
-            k: v['S'] for k, v in item.items()
+            k: _decode(v) for k, v in item.items()
+        }
+
+
+def page(limit, start=None, attributes=('id',)):
+    """Read one page of the table.
+
+    Returns the page's items and the id to continue from, which is
+    None once the whole table has been read. With `attributes` None
+    the whole of each item is read.
+    """
+    kwargs = {'TableName': os.environ['TABLE_NAME'], 'Limit': limit}
+    if attributes:
+        kwargs.update(
+            ProjectionExpression=', '.join(
+                f'#p{i}' for i in range(len(attributes))
+            ),
+            ExpressionAttributeNames={
+                f'#p{i}': name for i, name in enumerate(attributes)
+            }
+        )
+    if start is not None:
+        kwargs['ExclusiveStartKey'] = {'id': {'S': start}}
+    response = _dyn().scan(**kwargs)
+    items = [{k: _decode(v) for k, v in item.items()}
+             for item in response['Items']]
+    last = response.get('LastEvaluatedKey')
+    return items, last and _decode(last['id'])
+
+
+def count():
+    """Count the items in the table, reading only their keys."""
+    kwargs = {'TableName': os.environ['TABLE_NAME'], 'Select': 'COUNT'}
+    total = 0
+    while True:
+        response = _dyn().scan(**kwargs)
+        total += response['Count']
+        if 'LastEvaluatedKey' not in response:
+            return total
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def delete(id, only_if=None):
+    """Remove a follower, returning True if it was stored.
+
+    With `only_if`, a mapping of attribute names to values, it's only
+    removed if its stored values match, and False is returned if not.
+    """
+    kwargs = {}
+    if only_if:
+        kwargs = {
+            'ConditionExpression': ' AND '.join(
+                f'#c{i} = :c{i}' for i in range(len(only_if))
+            ),
+            'ExpressionAttributeNames': {
+                f'#c{i}': name for i, name in enumerate(only_if)
+            },
+            'ExpressionAttributeValues': {
+                f':c{i}': {'S': value}
+                for i, value in enumerate(only_if.values())
+            },
         }
+    try:
+        response = _dyn().delete_item(
+            TableName=os.environ['TABLE_NAME'],
+            Key={'id': {'S': id}},
+            ReturnValues='ALL_OLD',
+            **kwargs
+        )
+    except _dyn().exceptions.ConditionalCheckFailedException:
+        return False
+    return 'Attributes' in response
+
+
+def delete_many(ids):
+    """Remove followers in batches, without reporting which existed."""
+    ids = [*ids]
+    for start in range(0, len(ids), 25):
+        requests = {os.environ['TABLE_NAME']: [
+            {'DeleteRequest': {'Key': {'id': {'S': id}}}}
+            for id in ids[start:start + 25]
+        ]}
+        while requests:
+            response = _dyn().batch_write_item(RequestItems=requests)
+            requests = response.get('UnprocessedItems')
+
+
+# The state table holds items keyed by a prefixed `id`. Most are
+# short-lived bookkeeping (caches, counters, claims) that DynamoDB TTL
+# removes via the `expires` attribute, but published posts
+# (`object#`, see objects) have no expiry and are kept for good, so the
+# table mustn't be treated as disposable. It's optional: without
+# STATE_TABLE_NAME these helpers quietly do nothing.
 
+def state_enabled():
+    return 'STATE_TABLE_NAME' in os.environ
 
-def delete(id):
-    dyn.delete_item(
-        TableName=os.environ['TABLE_NAME'],
+
+def get_state(id):
+    if not state_enabled():
+        return None
+    response = _dyn().get_item(
+        TableName=os.environ['STATE_TABLE_NAME'],
+        Key={'id': {'S': id}}
+    )
+    if 'Item' not in response:
+        return None
+    item = {k: _decode(v) for k, v in response['Item'].items()}
+    # TTL deletion lags expiry, so check it ourselves
+    if 'expires' in item and item['expires'] < time.time():
+        return None
+    return item
+
+
+def put_state(item, ttl=None):
+    if not state_enabled():
+        return
+    if ttl is not None:
+        item = dict(item, expires=int(time.time() + ttl))
+    _dyn().put_item(
+        TableName=os.environ['STATE_TABLE_NAME'],
+        Item={k: _encode(v) for k, v in item.items()}
+    )
+
+
+def delete_state(id):
+    if not state_enabled():
+        return
+    _dyn().delete_item(
+        TableName=os.environ['STATE_TABLE_NAME'],
         Key={'id': {'S': id}}
     )
+
+
+def take_state(id, expired_only=False, only_if=None):
+    """Delete a state item, returning what it held (or None).
+
+    With `expired_only`, an item that hasn't yet expired is left alone,
+    as is one whose values don't match those in `only_if`. Only one of
+    any number of concurrent callers gets the item.
+    """
+    if not state_enabled():
+        return None
+    conditions, names, values = [], {}, {}
+    if expired_only:
+        conditions.append('expires < :now')
+        values[':now'] = _encode(int(time.time()))
+    for i, (name, value) in enumerate((only_if or {}).items()):
+        conditions.append(f'#c{i} = :c{i}')
+        names[f'#c{i}'] = name
+        values[f':c{i}'] = _encode(value)
+    kwargs = {}
+    if conditions:
+        kwargs['ConditionExpression'] = ' AND '.join(conditions)
+        kwargs['ExpressionAttributeValues'] = values
+    if names:
+        kwargs['ExpressionAttributeNames'] = names
+    try:
+        response = _dyn().delete_item(
+            TableName=os.environ['STATE_TABLE_NAME'],
+            Key={'id': {'S': id}},
+            ReturnValues='ALL_OLD',
+            **kwargs
+        )
+    except _dyn().exceptions.ConditionalCheckFailedException:
+        return None
+    item = response.get('Attributes')
+    return item and {k: _decode(v) for k, v in item.items()}
+
+
+def increment_state(id, values=None, existing=False, **amounts):
+    """Atomically add to numeric attributes of a state item.
+
+    Attributes in `values` are set in the same update. With `existing`
+    the item is only updated if it's already there, and None returned
+    if it isn't. Returns the updated attributes, or None without a
+    state table.
+    """
+    if not state_enabled():
+        return None
+    values = values or {}
+    names = {f'#a{i}': k for i, k in enumerate(amounts)}
+    names.update({f'#s{i}': k for i, k in enumerate(values)})
+    expression = 'ADD ' + ', '.join(
+        f'#a{i} :a{i}' for i in range(len(amounts))
+    )
+    if values:
+        expression += ' SET ' + ', '.join(
+            f'#s{i} = :s{i}' for i in range(len(values))
+        )
+    attribute_values = {
+        f':a{i}': _encode(v) for i, v in enumerate(amounts.values())
+    }
+    attribute_values.update({
+        f':s{i}': _encode(v) for i, v in enumerate(values.values())
+    })
+    kwargs = {}
+    if existing:
+        kwargs['ConditionExpression'] = 'attribute_exists(id)'
+    try:
+        response = _dyn().update_item(
+            TableName=os.environ['STATE_TABLE_NAME'],
+            Key={'id': {'S': id}},
+            UpdateExpression=expression,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=attribute_values,
+            ReturnValues='UPDATED_NEW',
+            **kwargs
+        )
+    except _dyn().exceptions.ConditionalCheckFailedException:
+        return None
+    return {k: _decode(v) for k, v in response['Attributes'].items()}
+
+
+def add_to_state_set(id, name, values, ttl):
+    """Atomically add strings to a set attribute of a state item.
+
+    The item's expiry is pushed back to `ttl` seconds from now.
+    """
+    if not state_enabled() or not values:
+        return
+    _dyn().update_item(
+        TableName=os.environ['STATE_TABLE_NAME'],
+        Key={'id': {'S': id}},
+        UpdateExpression='ADD #set :values SET #expires = :expires',
+        ExpressionAttributeNames={'#set': name, '#expires': 'expires'},
+        ExpressionAttributeValues={
+            ':values': _encode(set(values)),
+            ':expires': _encode(int(time.time() + ttl)),
+        }
+    )
+
+
+def set_state(id, **values):
+    """Set attributes of a state item, leaving the others alone."""
+    if not state_enabled():
+        return
+    _dyn().update_item(
+        TableName=os.environ['STATE_TABLE_NAME'],
+        Key={'id': {'S': id}},
+        UpdateExpression='SET ' + ', '.join(
+            f'#a{i} = :a{i}' for i in range(len(values))
+        ),
+        ExpressionAttributeNames={f'#a{i}': k for i, k in enumerate(values)},
+        ExpressionAttributeValues={
+            f':a{i}': _encode(v) for i, v in enumerate(values.values())
+        }
+    )
+
+
+def claim_state(id, ttl, **attributes):
+    """Create a state item unless a live one already exists.
+
+    Returns False if another caller holds an unexpired item, and True
+    (having written the item) otherwise - including when there's no
+    state table to coordinate through.
+    """
+    if not state_enabled():
+        return True
+    now = int(time.time())
+    item = dict(attributes, id=id, expires=now + ttl)
+    try:
+        _dyn().put_item(
+            TableName=os.environ['STATE_TABLE_NAME'],
+            Item={k: _encode(v) for k, v in item.items()},
+            ConditionExpression='attribute_not_exists(id) OR expires < :now',
+            ExpressionAttributeValues={':now': _encode(now)}
+        )
+    except _dyn().exceptions.ConditionalCheckFailedException:
+        return False
+    return True
@@ -0,0 +1,116 @@
+"""A follower list snapshot shared across warm invocations.
+
+Scanning the follower table for every post is wasteful when it rarely
+changes, so the scan result is kept for the life of the container. The
+incoming worker bumps a version counter in the state table whenever a
+follower is added or removed; a snapshot is reused for as long as that
+version hasn't moved.
+
+The same state item keeps a running count of followers, so the
+followers collection can report its size without a scan.
+
+Followers are stored one per actor, keyed by the actor's id. The id of
+the Follow that was accepted is kept in the state table too, so that
+an Undo which only names the Follow can still be matched to its actor.
+"""
+import config
+import dynamo
+
+VERSION_ID = 'followers'
+FOLLOW_PREFIX = 'follow#'
+
+_snapshot = None
+
+
+def version():
+    """Return the follower list's version, or None if it isn't tracked."""
+    if not dynamo.state_enabled():
+        return None
+    item = dynamo.get_state(VERSION_ID) or {}
+    return item.get('version', 0)
+
+
+def changed(added=0):
+    """Record that the follower list has changed.
+
+    `added` is the change in the number of followers, if any.
+    """
+    if added:
+        dynamo.increment_state(VERSION_ID, version=1, count=added)
+    else:
+        dynamo.increment_state(VERSION_ID, version=1)
+
+
+def count():
+    """Return the number of followers."""
+    item = dynamo.get_state(VERSION_ID) or {}
+    if item.get('counted'):
+        return item['count']
+
+    # the running count starts with a full count, made once - or on
+    # every call without a state table
+    total = dynamo.count()
+    dynamo.set_state(VERSION_ID, count=total, counted=True)
+    return total
+
+
+def snapshot():
+    """Return the current list of followers."""
+    global _snapshot
+    current = version()
+    if (_snapshot is not None and current is not None
+            and _snapshot[0] == current):
+        return _snapshot[1]
+
+    # the version is read before scanning, so a change that lands
+    # mid-scan is picked up by the next call
+    followers = [*dynamo.list(segments=config.FOLLOWER_SCAN_SEGMENTS)]
+    _snapshot = (current, followers)
+    return followers
+
+
+def remember_follow(follow_id, actor_id):
+    dynamo.put_state({'id': FOLLOW_PREFIX + follow_id, 'actor_id': actor_id})
+
+
+def forget_follow(follow_id):
+    dynamo.delete_state(FOLLOW_PREFIX + follow_id)
+
+
+def actor_for(follow_id):
+    """Return the actor who sent an accepted Follow, or None."""
+    item = dynamo.get_state(FOLLOW_PREFIX + follow_id)
+    return item and item['actor_id']
+
+
+def migrate(batch_size=100):
+    """Rekey followers still stored under their Follow's id.
+
+    Each is rewritten under its actor's id - unless the actor is
+    already stored that way, which makes it a duplicate - and its
+    Follow id remembered, before the old rows are deleted a batch at
+    a time. Yields `(scanned, rekeyed, duplicates)` for each batch.
+    Safe to run again, and alongside the functions.
+    """
+    start = None
+    migrated = False
+    while True:
+        items, start = dynamo.page(batch_size, start, attributes=None)
+        legacy = [item for item in items
+                  if 'actor_id' in item and item['id'] != item['actor_id']]
+        rekeyed = 0
+        for item in legacy:
+            follower = dict(item, id=item['actor_id'], follow_id=item['id'])
+            if dynamo.put(follower, unless_same=('actor_id',)) is not None:
+                rekeyed += 1
+            remember_follow(item['id'], item['actor_id'])
+        dynamo.delete_many(item['id'] for item in legacy)
+        migrated = migrated or bool(legacy)
+        yield len(items), rekeyed, len(legacy) - rekeyed
+        if start is None:
+            break
+
+    if migrated:
+        # recount, and have senders take a fresh snapshot
+        dynamo.set_state(VERSION_ID, count=dynamo.count(), counted=True)
+        changed()
@@ -0,0 +1,223 @@
+"""Turn SNS message text into HTML post content.
+
+Formatters are registered together with a cheap classifier, and tried
+in registration order; messages no formatter claims are treated as
+free text. A message is parsed as JSON at most once, and the result
+handed to every classifier:
+
+    @register(lambda msg, text: ...)
+    def my_format(msg, text):
+        return '<p>...</p>'
+
+`msg` is the parsed JSON object, or None if the message isn't JSON;
+`text` is the raw message.
+"""
+import re
+import json
+import html
+import threading
+
+FORMATTERS = []
+
+
+def register(classify):
+    """Register a formatter for messages accepted by `classify`.
+
+    >>> @register(lambda msg, text: text == 'ping')
+    ... def format_ping(msg, text):
+    ...     return '<p>pong</p>'
+    >>> format_message('ping')
+    '<p>pong</p>'
+    >>> _ = FORMATTERS.pop()
+
+    """
+    def _inner(func):
+        FORMATTERS.append((classify, func))
+        return func
+    return _inner
+
+
+def format_message(text):
+    msg = None
+    if text[:1] == '{':
+        try:
+            msg = json.loads(text)
+        except ValueError:
+            pass
+        if not isinstance(msg, dict):
+            msg = None
+
+    for classify, func in FORMATTERS:
+        if classify(msg, text):
+            return func(msg, text)
+    return text_to_html(text)
+
+
+def _lines(heading, *lines):
+    return '<p>' + ' <br>\n'.join(
+        [html.escape(heading)] + [html.escape(str(line)) for line in lines]
+    ) + '</p>'
+
+
+@register(lambda msg, text: msg is not None and 'AlarmName' in msg
+          and 'NewStateValue' in msg)
+def cloudwatch_alarm(msg, text):
+    """
+    >>> print(format_message(json.dumps({
+    ...     'AlarmName': 'api-errors', 'AWSAccountId': '123456789012',
+    ...     'Region': 'US East (N. Virginia)',
+    ...     'StateChangeTime': '2023-10-04T21:41:53.000+0000',
+    ...     'NewStateValue': 'ALARM', 'OldStateValue': 'OK',
+    ...     'NewStateReason': 'Threshold Crossed: 1 datapoint > 5'})))
+    <p>CloudWatch Alarm: api-errors <br>
+    Account: 123456789012 in US East (N. Virginia) <br>
+    At: 2023-10-04T21:41:53.000+0000 <br>
+    In State: ALARM from OK <br>
+    Reason: Threshold Crossed: 1 datapoint &gt; 5</p>
+
+    """
+    return _lines(
+        f"CloudWatch Alarm: {msg['AlarmName']}",
+        f"Account: {msg.get('AWSAccountId')} in {msg.get('Region')}",
+        f"At: {msg.get('StateChangeTime')}",
+        f"In State: {msg['NewStateValue']} from {msg.get('OldStateValue')}",
+        f"Reason: {msg.get('NewStateReason')}",
+    )
+
+
+@register(lambda msg, text: msg is not None
+          and msg.get('source') == 'aws.health' and 'detail' in msg)
+def health_event(msg, text):
+    """
+    >>> print(format_message(json.dumps({
+    ...     'source': 'aws.health', 'detail-type': 'AWS Health Event',
+    ...     'account': '123456789012', 'region': 'us-east-1',
+    ...     'time': '2023-10-04T21:41:53Z',
+    ...     'detail': {'service': 'EC2', 'statusCode': 'open',
+    ...                'eventTypeCode': 'AWS_EC2_OPERATIONAL_ISSUE',
+    ...                'eventDescription': [{'language': 'en_US',
+    ...                    'latestDescription': 'Increased API errors'}]}})))
+    <p>AWS Health: EC2 AWS_EC2_OPERATIONAL_ISSUE (open) <br>
+    Account: 123456789012 in us-east-1 <br>
+    At: 2023-10-04T21:41:53Z <br>
+    Increased API errors</p>
+
+    """
+    detail = msg['detail']
+    descriptions = [d.get('latestDescription', '')
+                    for d in detail.get('eventDescription', [])]
+    return _lines(
+        f"AWS Health: {detail.get('service')} "
+        f"{detail.get('eventTypeCode')} ({detail.get('statusCode')})",
+        f"Account: {msg.get('account')} in {msg.get('region')}",
+        f"At: {msg.get('time')}",
+        *descriptions[:1]
+    )
+
+
+@register(lambda msg, text: msg is not None and 'detail-type' in msg
+          and 'source' in msg)
+def eventbridge_event(msg, text):
+    """
+    >>> print(format_message(json.dumps({
+    ...     'source': 'aws.ecs', 'detail-type': 'ECS Task State Change',
+    ...     'account': '123456789012', 'region': 'us-east-1',
+    ...     'time': '2023-10-04T21:41:53Z',
+    ...     'resources': ['arn:aws:ecs:us-east-1:123456789012:task/x'],
+    ...     'detail': {}})))
+    <p>ECS Task State Change from aws.ecs <br>
+    Account: 123456789012 in us-east-1 <br>
+    At: 2023-10-04T21:41:53Z <br>
+    Resources: arn:aws:ecs:us-east-1:123456789012:task/x</p>
+
+    """
+    lines = [
+        f"Account: {msg.get('account')} in {msg.get('region')}",
+        f"At: {msg.get('time')}",
+    ]
+    if msg.get('resources'):
+        lines.append('Resources: ' + ', '.join(msg['resources']))
+    return _lines(f"{msg['detail-type']} from {msg['source']}", *lines)
+
+
+@register(lambda msg, text: msg is None
+          and text.startswith('AWS Budget Notification'))
+def budget_notification(msg, text):
+    """
+    >>> print(format_message('''AWS Budget Notification October 04, 2023
+    ... AWS Account 123456789012
+    ...
+    ... Dear AWS Customer,
+    ...
+    ... You requested that we alert you when the ACTUAL Cost associated
+    ... with your monthly budget is greater than $10.00.'''))
+    <p><strong>AWS Budget Notification October 04, 2023</strong> <br>
+    AWS Account 123456789012</p>
+    <p>You requested that we alert you when the ACTUAL Cost associated
+    with your monthly budget is greater than $10.00.</p>
+
+    """
+    paragraphs = _paragraphs(text)
+    heading = paragraphs[0].split('\n')
+    body = [p for p in paragraphs[1:] if not p.startswith('Dear AWS')]
+    return '\n'.join(
+        ['<p><strong>' + html.escape(heading[0]) + '</strong>' + ''.join(
+            ' <br>\n' + html.escape(line) for line in heading[1:]
+        ) + '</p>'] +
+        [f'<p>{_linkify(p)}</p>' for p in body]
+    )
+
+
+URL = re.compile(r'(https?://\S+)')
+
+# anything that might make markdown do more than wrap paragraphs
+MARKUP = re.compile(
+    r'[\\`*_{}\[\]()<>#+!|~&]|  \n|^\s*[-=]|^\s*\d+[.)]|^( {4}|\t)',
+    re.MULTILINE
+)
+
+
+def _paragraphs(text):
+    return [p.strip() for p in re.split(r'\n\s*\n', text.strip())
+            if p.strip()]
+
+
+def _linkify(text):
+    parts = URL.split(text)
+    return ''.join(
+        f'<a href="{html.escape(part)}">{html.escape(part)}</a>'
+        if i % 2 else html.escape(part, quote=False)
+        for i, part in enumerate(parts)
+    )
+
+
+_markdown = None
+_markdown_lock = threading.Lock()
+
+
+def render_markdown(text):
+    """Render with a single, reused Markdown instance."""
+    global _markdown
+    import markdown
+
+    with _markdown_lock:
+        if _markdown is None:
+            _markdown = markdown.Markdown()
+        return _markdown.reset().convert(text)
+
+
+def text_to_html(text):
+    """Linkify and render free text, skipping markdown if there's none.
+
+    >>> print(format_message('Deploy finished\\n\\nsee https://x.test/a_b'))
+    <p>Deploy finished</p>
+    <p>see <a href="https://x.test/a_b">https://x.test/a_b</a></p>
+    >>> print(format_message('Deploy *finished*: https://x.test/'))
+    <p>Deploy <em>finished</em>: <a href="https://x.test/">https://x.test/</a></p>
+
+    """
+    if MARKUP.search(URL.sub('', text)) is None:
+        return '\n'.join(f'<p>{_linkify(p)}</p>' for p in _paragraphs(text))
+
+    # let's linkify things properly
+    return render_markdown(URL.sub(r'[\1](\1)', text))
@@ -1,24 +1,74 @@
 import json
-import traceback
+from concurrent.futures import ThreadPoolExecutor
 from urllib.error import HTTPError
 
+import log
+import metrics
 import config
 import dynamo
+import followers
+import processed
 import apub.http
+import apub.keys
+import apub.utils
+import apub.signatures
+
+logger = log.get('incoming')
+
+
+def verify(request):
+    """Verify the signature of a request the inbox queued unchecked.
+
+    Returns the activity, or raises InvalidSignature.
+    """
+    actor = apub.signatures.verify_headers(
+        request['headers'],
+        request['path'],
+        method=request['method'],
+        digest=apub.signatures.body_digest(request['body'])
+    )
+    body = json.loads(request['body'])
+    if apub.utils.trim_frag(body.get('id', '')) != actor:
+        raise apub.signatures.InvalidSignature(
+            f'activity {body.get("id")} does not belong to signer {actor}'
+        )
+    return body
 
 
 def handle_one(record):
-    print('---------', record['messageId'])
-    print(json.dumps(record))
+    logger.debug('record: %s', log.Payload(record))
     body = json.loads(record['body'])
 
+    if 'signed_request' in body:
+        try:
+            body = verify(body['signed_request'])
+        except apub.signatures.KeyFetchFailed:
+            # maybe the signer's server is just down - try again later
+            raise
+        except apub.signatures.InvalidSignature as ex:
+            logger.info('dropped %s: %s', record['messageId'], ex)
+            return
+
     assert body['@context'] == 'https://www.w3.org/ns/activitystreams'
 
+    if not processed.claim(body['id']):
+        logger.info('skipping duplicate activity %s', body['id'])
+        metrics.count('duplicate_activity')
+        return
+    try:
+        apply(body, record)
+    except Exception:
+        processed.release(body['id'])
+        raise
+    processed.done(body['id'])
+
+
+def apply(body, record):
     if body['type'] == 'Follow':
         assert body['object'] == config.ACTOR
 
         # retrieve the follower's actor data
-        actor = apub.http.get(body['actor'])
+        actor = apub.http.get_cached(body['actor'])
         username = actor.get('preferredUsername', actor['id'].split('/')[-1])
         domain = actor['id'].split('/')[2]
         joined_name = f'{username}@{domain}'
@@ -27,17 +77,27 @@ def handle_one(record):
         if joined_name in config.FOLLOWERS:
             result = 'Accept'
 
-        print('Incoming follow request from', joined_name, ':', result)
+        logger.info('incoming follow request from %s: %s', joined_name,
+                    result)
 
-        # record the follower's info in dynamo
+        # record the follower's info in dynamo, once per actor however
+        # many times they follow
         if result == 'Accept':
-            dynamo.put({
-                'id': body['id'],
+            follower = {
+                'id': actor['id'],
+                'follow_id': body['id'],
                 'actor_id': actor['id'],
                 'inbox': actor['inbox'],
                 'username': actor.get('preferredUsername',
                                       actor['id'].split('/')[-1])
-            })
+            }
+            shared_inbox = actor.get('endpoints', {}).get('sharedInbox')
+            if shared_inbox:
+                follower['shared_inbox'] = shared_inbox
+            followers.remember_follow(body['id'], actor['id'])
+            added = dynamo.put(follower, unless_same=('follow_id', 'inbox'))
+            if added is not None:
+                followers.changed(added=int(added))
         
         # respond back to the actor's inbox
         apub.http.post(actor['inbox'], {
@@ -48,25 +108,116 @@ def handle_one(record):
             "object": body["id"],
         })
 
-    elif body['type'] == 'Undo' and body['object']['type'] == 'Follow':
+    elif body['type'] == 'Undo':
         # Handle Unfollow request
-        assert body['object']['object'] == config.ACTOR
+        follow_id, actor_id = _undone_follow(body)
+        if follow_id is None:
+            return
+        assert actor_id == apub.utils.trim_frag(body['actor'])
 
-        dynamo.delete(body['object']['id'])
+        # only if it's still the Follow being undone - a late Undo of
+        # an earlier one mustn't remove a follow made since - or one we
+        # still remember accepting from the actor, e.g. one merged into
+        # another by followers.migrate. Followers stored before they
+        # were keyed by actor are still keyed by their Follow's id.
+        removed = dynamo.delete(actor_id, only_if={'follow_id': follow_id})
+        if not removed and followers.actor_for(follow_id) == actor_id:
+            removed = dynamo.delete(actor_id)
+        removed = removed or dynamo.delete(follow_id)
+        followers.forget_follow(follow_id)
+        if removed:
+            followers.changed(added=-1)
+
+
+def _undone_follow(body):
+    """Return the follow id and actor an Undo applies to, if it's a Follow."""
+    undone = body['object']
+    if isinstance(undone, dict):
+        if undone.get('type') != 'Follow':
+            return None, None
+        assert undone['object'] == config.ACTOR
+        return undone['id'], body['actor']
+    # just the id - it's a Follow if it's one we accepted
+    actor_id = followers.actor_for(undone)
+    return (undone, actor_id) if actor_id else (None, None)
     
 
-def handler(event, context):
-    r = {'batchItemFailures': []}
-    for record in event['Records']:
+def _activity(record):
+    body = json.loads(record['body'])
+    if 'signed_request' in body:
+        return json.loads(body['signed_request']['body'])
+    return body
+
+
+def _ordering_key(record):
+    """Records from the same actor must be handled in order."""
+    try:
+        return _activity(record)['actor']
+    except Exception:
+        return record['messageId']
+
+
+def _key_id(record):
+    try:
+        headers = json.loads(record['body'])['signed_request']['headers']
+        return apub.signatures.parse_signature(headers)['keyId']
+    except Exception:
+        return None
+
+
+def _prefetch_key(key_id):
+    # failures show up again when the record is verified
+    try:
+        apub.keys.get(key_id)
+    except Exception:
+        pass
+
+
+def _handle_in_order(records):
+    """Handle one actor's records in turn, returning the failures.
+
+    Once a record fails and is going to be retried, the records after
+    it are left for the retry too, so that e.g. an Undo is never
+    applied before the Follow it undoes.
+    """
+    failures = []
+    for record in records:
+        if failures:
+            failures.append({'itemIdentifier': record['messageId']})
+            continue
         try:
             handle_one(record)
         except Exception as ex:
-            traceback.print_exc()
-            if isinstance(ex, HTTPError):
-                print(ex.headers)
-                print(ex.read())
+            logger.exception('failed processing %s', record['messageId'])
+            if isinstance(ex, HTTPError) and \
+                    log.verbose(logger):
+                logger.debug('response headers: %s',
+                             log.Payload(dict(ex.headers)))
+                logger.debug('response body: %s', log.Payload(ex.read()))
             if int(record['attributes']['ApproximateReceiveCount']) < 3:
-                r['batchItemFailures'].append({
+                failures.append({
                     'itemIdentifier': record['messageId']
                 })
+    return failures
+
+
+@metrics.instrument('incoming')
+def handler(event, context):
+    apub.http.set_deadline(context)
+    r = {'batchItemFailures': []}
+
+    groups = {}
+    for record in event['Records']:
+        groups.setdefault(_ordering_key(record), []).append(record)
+
+    # fetch the keys of records still to be verified all at once,
+    # rather than one actor group at a time
+    key_ids = {_key_id(record) for record in event['Records']} - {None}
+
+    workers = max(1, min(max(len(groups), len(key_ids)),
+                         config.INCOMING_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        [*pool.map(_prefetch_key, key_ids)]
+        for failures in pool.map(_handle_in_order, groups.values()):
+            r['batchItemFailures'].extend(failures)
     return r
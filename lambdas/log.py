@@ -0,0 +1,129 @@
+"""Leveled, sampled logging for the hot paths.
+
+Loggers are per category and built on the standard logging module, so
+messages are only formatted if they're actually emitted:
+
+    logger = log.get('http')
+    logger.info('POST to %s', url)
+    logger.debug('body: %s', log.Payload(body))
+
+Configuration comes from the environment:
+
+* LOG_LEVEL sets the overall level (default INFO).
+* LOG_LEVELS overrides it per category, e.g. `http=DEBUG,api=WARNING`.
+* LOG_SAMPLE keeps only a fraction of a category's records below
+  WARNING, e.g. `http=0.01`.
+
+Payload dumps (events, bodies, headers) are logged at DEBUG, so
+they're off unless a category is turned up, and signatures are
+redacted from them.
+"""
+import os
+import re
+import sys
+import json
+import random
+import logging
+
+ROOT = 'sns2ap'
+
+REDACTED = '[redacted]'
+SIGNATURE_PARAM = re.compile(r'(signature=")[^"]*(")')
+
+
+def _parse(setting):
+    """Parse a `category=value,...` setting.
+
+    >>> _parse('http=0.1, api=DEBUG')
+    {'http': '0.1', 'api': 'DEBUG'}
+    >>> _parse('')
+    {}
+
+    """
+    return dict(
+        part.strip().split('=', 1) for part in setting.split(',')
+        if '=' in part
+    )
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or \
+            random.random() < self.rate
+
+
+def redact(value):
+    """Strip signatures out of a payload before it's logged.
+
+    >>> redact({'Signature': 'keyId="a",signature="c2ln"', 'Host': 'x'})
+    {'Signature': '[redacted]', 'Host': 'x'}
+    >>> redact('keyId="a",headers="date",signature="c2ln"')
+    'keyId="a",headers="date",signature="[redacted]"'
+
+    """
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if k.lower() == 'signature' else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return SIGNATURE_PARAM.sub(rf'\g<1>{REDACTED}\g<2>', value)
+    return value
+
+
+class Payload:
+    """Defers serializing (and redacting) a payload until it's logged.
+
+    >>> str(Payload(b'{"a": 1}')), str(Payload({'a': [1]}))
+    ('{"a": 1}', '{"a": [1]}')
+
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, bytes):
+            value = value.decode(errors='replace')
+        if isinstance(value, str):
+            return redact(value)
+        return json.dumps(redact(value), default=str)
+
+
+def configure(environ=os.environ):
+    root = logging.getLogger(ROOT)
+    root.setLevel(environ.get('LOG_LEVEL', 'INFO').upper())
+    if not logging.getLogger().handlers and not root.handlers:
+        # outside Lambda there's nobody else to print our records
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter(
+            '%(levelname)s %(name)s %(message)s'
+        ))
+        root.addHandler(handler)
+
+    for category, level in _parse(environ.get('LOG_LEVELS', '')).items():
+        logging.getLogger(f'{ROOT}.{category}').setLevel(level.upper())
+
+    for category, rate in _parse(environ.get('LOG_SAMPLE', '')).items():
+        logger = logging.getLogger(f'{ROOT}.{category}')
+        for f in [f for f in logger.filters if isinstance(f, SampleFilter)]:
+            logger.removeFilter(f)
+        logger.addFilter(SampleFilter(float(rate)))
+
+
+def get(category):
+    return logging.getLogger(f'{ROOT}.{category}')
+
+
+def verbose(logger):
+    """Whether `logger` emits DEBUG records, to guard costly extras."""
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+configure()
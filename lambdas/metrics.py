@@ -0,0 +1,147 @@
+"""Per-invocation timings and counters, emitted as CloudWatch metrics.
+
+Handlers are wrapped with `instrument`, and the code they call records
+into the current invocation:
+
+    with metrics.span('sign'):
+        ...
+    metrics.count('delivered')
+
+When the handler returns, everything recorded is printed as a single
+CloudWatch Embedded Metric Format record: a count, p50 and p99 for
+each span, the counters, and per-remote-host request timings and
+failure totals (as properties, to keep metric cardinality down).
+Only the MAX_HOSTS hosts with the most failures, then requests, are
+listed, so that a large fan-out can't push the record past CloudWatch
+Logs' event size limit; the failure total still covers them all.
+"""
+import json
+import time
+import functools
+import threading
+import contextlib
+
+NAMESPACE = 'SnsToActivityPub'
+
+MAX_HOSTS = 50
+
+_lock = threading.Lock()
+_timings = {}
+_counts = {}
+_hosts = {}
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of values.
+
+    >>> percentile([5, 1, 4, 2, 3], 50), percentile(list(range(100)), 99)
+    (3, 98)
+
+    """
+    ordered = sorted(values)
+    rank = max(0, -(-len(ordered) * p // 100) - 1)
+    return ordered[int(rank)]
+
+
+def record(name, ms, host=None):
+    with _lock:
+        _timings.setdefault(name, []).append(ms)
+        if host is not None:
+            stats = _hosts.setdefault(host, {'timings': [], 'failures': 0})
+            stats['timings'].append(ms)
+
+
+@contextlib.contextmanager
+def span(name, host=None):
+    """Time the enclosed block, optionally attributing it to a host."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - started) * 1000, host)
+
+
+def count(name, n=1):
+    with _lock:
+        _counts[name] = _counts.get(name, 0) + n
+
+
+def host_failure(host):
+    with _lock:
+        _hosts.setdefault(host, {'timings': [], 'failures': 0})
+        _hosts[host]['failures'] += 1
+
+
+def reset():
+    with _lock:
+        _timings.clear()
+        _counts.clear()
+        _hosts.clear()
+
+
+def emf(function):
+    """Build the EMF record for everything recorded so far."""
+    with _lock:
+        doc = {'Function': function}
+        metrics = []
+        for name, values in sorted(_timings.items()):
+            for stat, value in (('p50', percentile(values, 50)),
+                                ('p99', percentile(values, 99))):
+                doc[f'{name}.{stat}'] = round(value, 2)
+                metrics.append({'Name': f'{name}.{stat}',
+                                'Unit': 'Milliseconds'})
+            doc[f'{name}.count'] = len(values)
+            metrics.append({'Name': f'{name}.count', 'Unit': 'Count'})
+        for name, value in sorted(_counts.items()):
+            doc[name] = value
+            metrics.append({'Name': name, 'Unit': 'Count'})
+
+        if _hosts:
+            doc['host_failures'] = sum(h['failures'] for h in _hosts.values())
+            metrics.append({'Name': 'host_failures', 'Unit': 'Count'})
+            worst = sorted(
+                _hosts.items(), key=lambda item: (-item[1]['failures'],
+                                                  -len(item[1]['timings']))
+            )[:MAX_HOSTS]
+            doc['hosts'] = {
+                host: {
+                    'requests': len(stats['timings']),
+                    'failures': stats['failures'],
+                    'p50': round(percentile(stats['timings'], 50), 2)
+                    if stats['timings'] else None,
+                }
+                for host, stats in worst
+            }
+            if len(_hosts) > MAX_HOSTS:
+                doc['hosts_omitted'] = len(_hosts) - MAX_HOSTS
+
+    doc['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': NAMESPACE,
+            'Dimensions': [['Function']],
+            'Metrics': metrics,
+        }],
+    }
+    return doc
+
+
+def flush(function):
+    # EMF records must be written to stdout as-is, not via logging
+    print(json.dumps(emf(function)))
+    reset()
+
+
+def instrument(function):
+    """Decorate a Lambda handler to emit its metrics when it returns."""
+    def _decorator(handler):
+        @functools.wraps(handler)
+        def _wrapped(*args, **kwargs):
+            reset()
+            try:
+                with span('invocation'):
+                    return handler(*args, **kwargs)
+            finally:
+                flush(function)
+        return _wrapped
+    return _decorator
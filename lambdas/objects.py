@@ -0,0 +1,38 @@
+"""Published posts, kept so that their ids can be dereferenced.
+
+The sender stores each public activity as it's sent, and the api
+serves it back from a single state table lookup. Posts never change
+once published, so each container also keeps recent ones in memory.
+
+Alerts are direct messages to each follower, so they aren't stored.
+"""
+import json
+
+import config
+import dynamo
+from apub.cache import LRUCache
+
+PREFIX = 'object#'
+
+MEMORY = LRUCache(maxsize=config.OBJECT_CACHE_SIZE)
+
+
+def store(message_id, payload):
+    """Keep the serialized activity published for a message.
+
+    It's stored without an expiry, as posts stay dereferenceable.
+    """
+    dynamo.put_state({'id': PREFIX + message_id,
+                      'activity': payload.decode()})
+
+
+def load(message_id):
+    """Return the activity published for a message, or None."""
+    activity = MEMORY.get(message_id)
+    if activity is None:
+        item = dynamo.get_state(PREFIX + message_id)
+        if item is None:
+            return None
+        activity = json.loads(item['activity'])
+        MEMORY.set(message_id, activity)
+    return activity
@@ -0,0 +1,47 @@
+"""Remembers which incoming activities have already been handled.
+
+Remote servers redeliver activities, and SQS redelivers records, so an
+activity is claimed by its id before it's acted on. A claim is a
+conditional write to the state table: it lasts PROCESSED_LEASE seconds
+while the activity is handled, becomes PROCESSED_TTL once it's done,
+and is dropped if handling fails so that a retry can claim it again.
+A claim that's never finished - say the invocation timed out - simply
+lapses.
+
+Ids this container has seen are also kept in memory, so most
+duplicates are dropped without a DynamoDB call.
+"""
+import config
+import dynamo
+from apub.cache import LRUCache
+
+PREFIX = 'processed#'
+
+RECENT = LRUCache(maxsize=config.PROCESSED_CACHE_SIZE,
+                  ttl=config.PROCESSED_TTL)
+
+
+def claim(activity_id):
+    """Return True if the caller should handle the activity."""
+    if RECENT.get(activity_id):
+        return False
+    if not dynamo.claim_state(PREFIX + activity_id, config.PROCESSED_LEASE,
+                              status='processing'):
+        # it may still be in hand elsewhere, and released if that fails
+        RECENT.set(activity_id, True, ttl=config.PROCESSED_LEASE)
+        return False
+    RECENT.set(activity_id, True, ttl=config.PROCESSED_LEASE)
+    return True
+
+
+def done(activity_id):
+    """Record that a claimed activity has been handled."""
+    RECENT.set(activity_id, True)
+    dynamo.put_state({'id': PREFIX + activity_id, 'status': 'done'},
+                     ttl=config.PROCESSED_TTL)
+
+
+def release(activity_id):
+    """Give up a claim, so the activity can be handled again."""
+    RECENT.delete(activity_id)
+    dynamo.delete_state(PREFIX + activity_id)
@@ -0,0 +1,37 @@
+"""Which recipients of a post have already been dealt with.
+
+The sender records each inbox a message has been delivered (or queued)
+to as it goes, so that a continuation or retry of the same message
+skips them. Inboxes are stored as short hashes in a string set on one
+state table item per message, which keeps well within DynamoDB's item
+size limit for tens of thousands of recipients.
+"""
+import hashlib
+
+import config
+import dynamo
+
+PREFIX = 'fanout#'
+
+
+def key(inbox):
+    """Hash an inbox URL for the progress set.
+
+    >>> key('https://a.local/inbox')
+    'c6bb80d5987b2a79'
+
+    """
+    return hashlib.sha256(inbox.encode()).hexdigest()[:16]
+
+
+def done(message_id):
+    """Return the keys of the inboxes a message has been handled for."""
+    item = dynamo.get_state(PREFIX + message_id) or {}
+    return item.get('inboxes', set())
+
+
+def record(message_id, inboxes):
+    """Add to the inboxes a message has been handled for."""
+    dynamo.add_to_state_set(PREFIX + message_id, 'inboxes',
+                            {key(inbox) for inbox in inboxes},
+                            config.FANOUT_PROGRESS_TTL)
@@ -0,0 +1,140 @@
+"""Queues used to hand work from one function to another.
+
+SqsQueue talks to a real SQS queue. MemoryQueue keeps messages in
+process and mimics the parts of SQS the workers depend on (batches,
+visibility timeouts, receive counts), so a planner and its worker can
+be exercised together without AWS.
+"""
+import os
+import json
+import time
+import uuid
+import functools
+
+import aws
+
+
+class SqsQueue:
+    def __init__(self, url):
+        self.url = url
+        self.sqs = aws.client('sqs')
+
+    def send(self, body, delay=0):
+        self.sqs.send_message(QueueUrl=self.url, MessageBody=body,
+                              DelaySeconds=delay)
+
+    def send_batch(self, bodies):
+        for start in range(0, len(bodies), 10):
+            response = self.sqs.send_message_batch(
+                QueueUrl=self.url,
+                Entries=[
+                    {'Id': str(i), 'MessageBody': body}
+                    for i, body in enumerate(bodies[start:start + 10])
+                ]
+            )
+            if response.get('Failed'):
+                raise RuntimeError('failed to enqueue: ' +
+                                   json.dumps(response['Failed']))
+
+    def retry_later(self, record, delay):
+        self.sqs.change_message_visibility(
+            QueueUrl=self.url,
+            ReceiptHandle=record['receiptHandle'],
+            VisibilityTimeout=delay
+        )
+
+
+class MemoryQueue:
+    """An in-process stand-in for SqsQueue.
+
+    >>> q = MemoryQueue()
+    >>> q.send_batch(['a', 'b'])
+    >>> [r['body'] for r in q.receive()]
+    ['a', 'b']
+    >>> q.receive()
+    []
+
+    Messages that aren't deleted become visible again once their
+    visibility timeout passes, with their receive count bumped.
+
+    >>> q.advance(q.visibility_timeout)
+    >>> [(r['body'], r['attributes']['ApproximateReceiveCount'])
+    ...  for r in q.receive()]
+    [('a', '2'), ('b', '2')]
+
+    """
+    def __init__(self, visibility_timeout=30):
+        self.visibility_timeout = visibility_timeout
+        self.messages = {}
+        self.skew = 0
+
+    def now(self):
+        return time.time() + self.skew
+
+    def advance(self, seconds):
+        self.skew += seconds
+
+    def send(self, body, delay=0):
+        message_id = str(uuid.uuid4())
+        self.messages[message_id] = {
+            'body': body, 'receives': 0, 'visible_at': self.now() + delay
+        }
+
+    def send_batch(self, bodies):
+        for body in bodies:
+            self.send(body)
+
+    def receive(self, max_messages=10):
+        records = []
+        now = self.now()
+        for message_id, message in self.messages.items():
+            if len(records) == max_messages:
+                break
+            if message['visible_at'] > now:
+                continue
+            message['receives'] += 1
+            message['visible_at'] = now + self.visibility_timeout
+            records.append({
+                'messageId': message_id,
+                'receiptHandle': message_id,
+                'body': message['body'],
+                'attributes': {
+                    'ApproximateReceiveCount': str(message['receives'])
+                },
+            })
+        return records
+
+    def delete(self, record):
+        self.messages.pop(record['messageId'], None)
+
+    def retry_later(self, record, delay):
+        if record['messageId'] in self.messages:
+            self.messages[record['messageId']]['visible_at'] = (
+                self.now() + delay
+            )
+
+    def process(self, handler, max_messages=10):
+        """Deliver one batch to an SQS-style handler, as Lambda would.
+
+        Returns the number of records handed to the handler.
+        """
+        records = self.receive(max_messages)
+        if records:
+            response = handler({'Records': records}, None) or {}
+            failed = {f['itemIdentifier']
+                      for f in response.get('batchItemFailures', [])}
+            for record in records:
+                if record['messageId'] not in failed:
+                    self.delete(record)
+        return len(records)
+
+    def __len__(self):
+        return len(self.messages)
+
+
+@functools.lru_cache(maxsize=None)
+def delivery_queue():
+    """Return the queue of per-inbox delivery jobs, if one is configured."""
+    if 'DELIVERY_QUEUE' not in os.environ:
+        return None
+    return SqsQueue(os.environ['DELIVERY_QUEUE'])
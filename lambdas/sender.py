@@ -1,40 +1,41 @@
 import os
-import re
 import json
-import markdown
+import time
+import uuid
+from datetime import datetime, timezone
 
+import aws
+import log
+import metrics
 import config
-import dynamo
+import formatters
+import queues
+import delivery
+import coalesce
+import objects
+import progress
+import followers
 import apub.http
-import apub.signatures
+import apub.fanout
+import apub.prepared
 
+logger = log.get('sender')
 
-def cloudwatch_to_body(message):
-    """Turn a CloudWatch Alarm message into a legible body.
-    """
-    try:
-        msgd = json.loads(message)
-    except json.decoder.JSONDecodeError:
-        return f'<p>{message}</p>'
-    return f'''<p>CloudWatch Alarm: {msgd['AlarmName']} <br>
-Account: {msgd['AWSAccountId']} in {msgd['Region']} <br>
-At: {msgd['StateChangeTime']} <br>
-In State: {msgd['NewStateValue']} from {msgd['OldStateValue']} <br>
-Reason: {msgd['NewStateReason']}</p>'''
+lambda_ = None
+
+
+def _lambda():
+    return lambda_ or aws.client('lambda')
 
 
 def sns_to_post(record):
     message_id = record['Sns']['MessageId']
     message_timestamp = record['Sns']['Timestamp']
 
-    message = record['Sns']['Message']
-    if message.startswith('{') and 'arn:aws:cloudwatch' in message:
-        message_body = cloudwatch_to_body(message)
-    else:
-        # let's linkify things properly
-        message_md = re.sub(r'(https?://\S+)', r'[\1](\1)', message)
-        message_body = markdown.markdown(message_md)
-    
+    # digests come with their content ready formatted
+    message_body = record.get('content') or \
+        formatters.format_message(record['Sns']['Message'])
+
     return {
         "@context": "https://www.w3.org/ns/activitystreams",
         "id": f'{config.BASEURL}/create/{message_id}',
@@ -56,23 +57,216 @@ TOPICS = {
 }
 
 
+def digest_record(content, timestamp=None):
+    """Wrap a digest of coalesced alerts up as an alert topic record."""
+    timestamp = timestamp or \
+        datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+    return {'Sns': {
+        'MessageId': f'digest-{uuid.uuid4()}',
+        'Timestamp': timestamp.replace('+00:00', 'Z'),
+        'TopicArn': os.environ['ALERT_TOPIC_ARN'],
+        'Message': '',
+    }, 'content': content}
+
+
+def admit_alerts(records, queue=None):
+    """Hold back repeated alerts, returning the records to send.
+
+    Digests of earlier bursts that have come due are added in front
+    of the alert that found them.
+    """
+    if not config.COALESCE_WINDOW:
+        return records
+    admitted = []
+    for record in records:
+        if TOPICS[record['Sns']['TopicArn']] != 'alert':
+            admitted.append(record)
+            continue
+        send, overdue = coalesce.admit(record['Sns']['Message'],
+                                       record['Sns']['Timestamp'], queue,
+                                       record['Sns']['MessageId'])
+        if overdue:
+            admitted.append(digest_record(overdue))
+        if send:
+            admitted.append(record)
+        else:
+            logger.info('holding back repeated alert %s',
+                        record['Sns']['MessageId'])
+            metrics.count('alert_coalesced')
+    return admitted
+
+
+def plan(post, topic, dests):
+    """Work out the `(inbox, payload)` deliveries for a post.
+
+    The post is serialized once; each payload is the serialized
+    activity with the recipient fields filled in.
+
+    Info posts are public to our followers, so a single copy is sent
+    to each distinct shared inbox (falling back to the personal inbox
+    for servers that don't advertise one).
+
+    >>> dests = [
+    ...     {'actor_id': 'https://a.local/users/x', 'username': 'x',
+    ...      'inbox': 'https://a.local/users/x/inbox',
+    ...      'shared_inbox': 'https://a.local/inbox'},
+    ...     {'actor_id': 'https://a.local/users/y', 'username': 'y',
+    ...      'inbox': 'https://a.local/users/y/inbox',
+    ...      'shared_inbox': 'https://a.local/inbox'},
+    ...     {'actor_id': 'https://b.local/users/z', 'username': 'z',
+    ...      'inbox': 'https://b.local/users/z/inbox'},
+    ... ]
+    >>> post = {'object': {'type': 'Note'}}
+    >>> [inbox for inbox, _ in plan(post, 'info', dests)]
+    ['https://a.local/inbox', 'https://b.local/users/z/inbox']
+
+    Alerts are direct messages, so each follower gets their own copy
+    addressed to (and mentioning) them, delivered to their personal
+    inbox.
+
+    >>> [(inbox, json.loads(payload)['object']['to'])
+    ...  for inbox, payload in plan(post, 'alert', dests)]
+    ...  #doctest: +NORMALIZE_WHITESPACE
+    [('https://a.local/users/x/inbox', 'https://a.local/users/x'),
+     ('https://a.local/users/y/inbox', 'https://a.local/users/y'),
+     ('https://b.local/users/z/inbox', 'https://b.local/users/z')]
+
+    """
+    prepared = apub.prepared.PreparedActivity(post)
+
+    if topic == 'info':
+        payload = prepared.render(to=config.ACTOR_FOLLOWERS)
+        inboxes = dict.fromkeys(
+            dest.get('shared_inbox') or dest['inbox'] for dest in dests
+        )
+        return [(inbox, payload) for inbox in inboxes]
+
+    jobs = []
+    for dest in dests:
+        jobs.append((dest['inbox'], prepared.render(
+            to=dest['actor_id'],
+            tag=[{
+                'type': 'Mention',
+                'name': f'@{dest["username"]}',
+                'href': dest['actor_id']
+            }]
+        )))
+    return jobs
+
+
+def reserve(remaining):
+    """Seconds of an invocation's `remaining` time kept for the handover.
+
+    That's FANOUT_RESERVE, but never more than a quarter of the time
+    left, so that a short timeout still leaves time to deliver.
+
+    >>> reserve(600), reserve(1)
+    (20.0, 0.25)
+
+    """
+    return min(config.FANOUT_RESERVE, remaining / 4)
+
+
+def fan_out(message_id, jobs, queue=None):
+    """Deliver a message's jobs, or queue them, checkpointing as it goes.
+
+    Inboxes already handled for the message are skipped. Work stops
+    short of the invocation's deadline, leaving `reserve` seconds for
+    the handover; returns the delivery results and whether every job
+    was handled.
+    """
+    handled = progress.done(message_id)
+    jobs = [job for job in jobs if progress.key(job[0]) not in handled]
+    if handled:
+        logger.info('resuming %s with %d inboxes left', message_id,
+                    len(jobs))
+
+    remaining = apub.http.remaining()
+    stop_at = None
+    if remaining is not None:
+        stop_at = time.monotonic() + remaining - reserve(remaining)
+
+    results = []
+    for start in range(0, len(jobs), config.FANOUT_CHECKPOINT_EVERY):
+        if stop_at is not None and time.monotonic() >= stop_at:
+            return results, False
+        chunk = jobs[start:start + config.FANOUT_CHECKPOINT_EVERY]
+
+        if queue is not None:
+            # hand off to the delivery workers
+            queue.send_batch([delivery.job(*job) for job in chunk])
+            logger.info('queued %d deliveries', len(chunk))
+            progress.record(message_id, [inbox for inbox, _ in chunk])
+            continue
+
+        delivered = apub.fanout.deliver(chunk, stop_at=stop_at)
+        done = [r for r in delivered if r is not None]
+        logger.info('delivered to %d of %d inboxes',
+                    sum(r['ok'] for r in done), len(chunk))
+        results.extend(done)
+        # inboxes worth retrying are left for the next attempt
+        progress.record(message_id, [
+            r['inbox'] for r in done if r['ok'] or not delivery.retryable(r)
+        ])
+        if len(done) < len(chunk):
+            return results, False
+
+    return results, True
+
+
+def continue_later(event, records, context):
+    """Hand the records this invocation ran out of time for to another."""
+    continuation = event.get('continuation', 0) + 1
+    if context is None or continuation > config.FANOUT_MAX_CONTINUATIONS:
+        logger.error('giving up on %d messages after %d continuations',
+                     len(records), continuation - 1)
+        return
+
+    logger.info('continuing %d messages in a new invocation', len(records))
+    metrics.count('fanout_continued')
+    # the records are already past coalescing, which mustn't count
+    # them a second time
+    _lambda().invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps({'Records': records, 'continuation': continuation,
+                            'coalesced': True})
+    )
+
+
+@metrics.instrument('sender')
 def handler(event, context):
-    print(json.dumps(event))
-    for record in event['Records']:
+    logger.debug('event: %s', log.Payload(event))
+    apub.http.set_deadline(context)
+    queue = queues.delivery_queue()
+    results = []
+    dests = followers.snapshot()
+    records = event['Records']
+    if not event.get('coalesced'):
+        records = admit_alerts(records, queue)
+    for n, record in enumerate(records):
         post = sns_to_post(record)
 
         # deliver the post depending on the source topic
         topic = TOPICS[record['Sns']['TopicArn']]
+        jobs = plan(post, topic, dests)
+
         if topic == 'info':
-            post['object']['to'] = config.ACTOR_FOLLOWERS
-
-        for dest in dynamo.list():
-            if topic == 'alert':
-                post['object']['to'] = dest['actor_id']
-                post['object']['tag'] = [{
-                    'type': 'Mention',
-                    'name': f'@{dest["username"]}',
-                    'href': dest['actor_id']
-                }]
-            apub.http.post(dest['inbox'], post)
+            # stored first, so recipients can fetch it as soon as it
+            # arrives - but a post that can't be stored is still sent
+            try:
+                # every info job carries the same payload
+                payload = jobs[0][1] if jobs else \
+                    apub.prepared.PreparedActivity(post).render(
+                        to=config.ACTOR_FOLLOWERS)
+                objects.store(record['Sns']['MessageId'], payload)
+            except Exception:
+                logger.exception('failed storing %s', post['id'])
+
+        delivered, finished = fan_out(record['Sns']['MessageId'], jobs, queue)
+        results.extend(delivered)
+        if not finished:
+            continue_later(event, records[n:], context)
+            break
 
+    return results
@@ -0,0 +1,38 @@
+"""Rekey the follower table by actor id, removing duplicate followers.
+
+Followers used to be stored under the id of the Follow activity that
+was accepted, so an actor who followed more than once was stored - and
+sent every post - more than once. Run this once after upgrading, with
+the environment of the deployed functions:
+
+    DOMAIN_NAME=... TABLE_NAME=... STATE_TABLE_NAME=... \\
+        python scripts/migrate_followers.py
+
+It works through the table a batch at a time, and can safely be run
+again or while the functions are live.
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lambdas'))
+
+import followers  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='followers read per batch')
+    args = parser.parse_args()
+
+    totals = [0, 0, 0]
+    for batch in followers.migrate(args.batch_size):
+        totals = [t + n for t, n in zip(totals, batch)]
+        print('scanned %d, rekeyed %d, removed %d duplicates' % tuple(totals),
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+from unittest import mock
+
+import pytest
+
+import config
+from apub import breaker
+
+
+@pytest.fixture(autouse=True)
+def hosts():
+    breaker.HOSTS.clear()
+    yield breaker.HOSTS
+    breaker.HOSTS.clear()
+
+
+def test_opens_after_threshold_and_probes():
+    for _ in range(config.BREAKER_THRESHOLD):
+        breaker.check('dead.local')
+        breaker.failure('dead.local')
+
+    with pytest.raises(breaker.CircuitOpen):
+        breaker.check('dead.local')
+    breaker.check('alive.local')
+
+    # once the cooldown passes a single probe is allowed through
+    later = breaker.time.time() + config.BREAKER_COOLDOWN + 1
+    with mock.patch('apub.breaker.time.time', return_value=later):
+        breaker.check('dead.local')
+        with pytest.raises(breaker.CircuitOpen):
+            breaker.check('dead.local')
+
+        breaker.success('dead.local')
+        breaker.check('dead.local')
+
+
+def test_state_is_shared_through_state_table():
+    saved = {}
+    with mock.patch('dynamo.put_state',
+                    lambda item, ttl=None: saved.update({item['id']: item})):
+        for _ in range(config.BREAKER_THRESHOLD):
+            breaker.failure('dead.local')
+    assert saved['breaker#dead.local']['failures'] == config.BREAKER_THRESHOLD
+
+    # another container picks up the open circuit
+    breaker.HOSTS.clear()
+    with mock.patch('dynamo.get_state', saved.get):
+        with pytest.raises(breaker.CircuitOpen):
+            breaker.check('dead.local')
+
+
+def test_deadline_bounds_requests():
+    from apub import http
+
+    context = mock.Mock()
+    context.get_remaining_time_in_millis.return_value = 0
+    http.set_deadline(context)
+    try:
+        with pytest.raises(TimeoutError):
+            http.request('GET', 'https://slow.local/actor')
+    finally:
+        http.set_deadline(None)
+    assert 'slow.local' not in breaker.HOSTS
+
+
+def test_probe_is_released_whatever_it_raises():
+    from apub import http
+
+    for _ in range(config.BREAKER_THRESHOLD):
+        breaker.failure('odd.local')
+
+    later = breaker.time.time() + config.BREAKER_COOLDOWN + 1
+    with mock.patch('apub.breaker.time.time', return_value=later), \
+            mock.patch.object(http.POOL, 'request',
+                              side_effect=UnicodeError('bad label')):
+        with pytest.raises(UnicodeError):
+            http.request('GET', 'https://odd.local/actor')
+        # the next request is let through as a new probe
+        with pytest.raises(UnicodeError):
+            http.request('GET', 'https://odd.local/actor')
+
+
+def test_state_table_is_read_outside_the_lock():
+    def get_state(id):
+        assert not breaker.LOCK.locked()
+        return None
+
+    with mock.patch('dynamo.get_state', get_state):
+        breaker.check('new.local')
+        breaker.success('other.local')
+    assert set(breaker.HOSTS) == {'new.local', 'other.local'}
@@ -0,0 +1,92 @@
+import threading
+import time
+from unittest import mock
+from urllib.error import HTTPError
+
+import pytest
+
+from apub import http
+from apub.cache import FetchCache
+
+
+def test_concurrent_misses_share_one_load():
+    started, release = threading.Event(), threading.Event()
+    loads = []
+
+    def load(key):
+        loads.append(key)
+        started.set()
+        release.wait(5)
+        return {'id': key}
+
+    cache = FetchCache(load, ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('a')))
+               for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert loads == ['a']
+    assert results == [{'id': 'a'}] * 5
+
+
+def test_failures_are_shared_but_not_kept():
+    load = mock.Mock(side_effect=[OSError('down'), 'back'])
+    cache = FetchCache(load, ttl=60)
+    with pytest.raises(OSError):
+        cache.get('a')
+    assert cache.get('a') == 'back'
+    assert load.call_count == 2
+
+
+def test_stale_entries_are_served_while_refreshed():
+    load = mock.Mock(side_effect=['old', 'new'])
+    cache = FetchCache(load, ttl=0.01, stale=60)
+    assert cache.get('a') == 'old'
+    time.sleep(0.02)
+
+    assert cache.get('a') == 'old'
+    for _ in range(100):
+        if load.call_count == 2 and not cache.loading:
+            break
+        time.sleep(0.01)
+    assert cache.get('a') == 'new'
+    assert cache.stats == {'hit': 1, 'stale': 1, 'miss': 1, 'negative': 0}
+
+
+def test_refresh_skips_the_cache():
+    load = mock.Mock(side_effect=['old', 'new'])
+    cache = FetchCache(load, ttl=60)
+    assert cache.get('a') == 'old'
+    assert cache.get('a', refresh=True) == 'new'
+    assert cache.get('a') == 'new'
+
+
+def test_get_cached_remembers_missing_actors():
+    gone = HTTPError('https://mastodon.local/users/a', 410, 'Gone', {}, None)
+    counts = []
+    raised = []
+    with mock.patch('apub.http.get', side_effect=gone) as get, \
+            mock.patch('metrics.count', side_effect=counts.append):
+        for _ in range(3):
+            with pytest.raises(HTTPError) as ex:
+                http.get_cached('https://mastodon.local/users/a#main-key')
+            raised.append(ex.value)
+
+    get.assert_called_once_with('https://mastodon.local/users/a')
+    assert counts == ['actor_cache_miss'] + ['actor_cache_negative'] * 2
+    # each hit raises an error of its own
+    assert raised[1] is not raised[2]
+    assert [e.code for e in raised] == [410] * 3
+
+
+def test_get_cached_is_bounded():
+    with mock.patch('apub.http.get', side_effect=lambda url: {'id': url}):
+        for n in range(http.GET_CACHE.entries.maxsize + 10):
+            http.get_cached(f'https://mastodon.local/users/{n}')
+    assert len(http.GET_CACHE) == http.GET_CACHE.entries.maxsize
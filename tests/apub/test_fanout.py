@@ -0,0 +1,55 @@
+import time
+import threading
+from unittest import mock
+from urllib.error import HTTPError
+
+from apub import fanout
+
+
+def test_deliver_respects_per_host_limit():
+    lock = threading.Lock()
+    active = {}
+    peak = {}
+
+    def mock_post(url, body):
+        host = url.split('/')[2]
+        with lock:
+            active[host] = active.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), active[host])
+        time.sleep(0.01)
+        with lock:
+            active[host] -= 1
+        return {'url': url}
+
+    jobs = [
+        (f'https://{host}.local/users/{i}/inbox', {'n': i})
+        for host in ('a', 'b', 'c')
+        for i in range(10)
+    ]
+    with mock.patch('apub.http.post', mock_post):
+        results = fanout.deliver(jobs, max_workers=8, per_host=2)
+
+    assert [r['inbox'] for r in results] == [inbox for inbox, _ in jobs]
+    assert all(r['ok'] for r in results)
+    assert max(peak.values()) <= 2
+
+
+def test_deliver_isolates_failures():
+    def mock_post(url, body):
+        if 'broken' in url:
+            raise HTTPError(url, 500, 'Server error', {}, None)
+        return {}
+
+    jobs = [
+        ('https://broken.local/inbox', {}),
+        ('https://fine.local/inbox', {}),
+    ]
+    with mock.patch('apub.http.post', mock_post):
+        results = fanout.deliver(jobs)
+
+    assert not results[0]['ok']
+    assert 'HTTPError' in results[0]['error']
+    assert results[0]['status'] == 500
+    assert results[1] == {
+        'inbox': 'https://fine.local/inbox', 'ok': True, 'response': {}
+    }
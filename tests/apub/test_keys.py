@@ -0,0 +1,84 @@
+from unittest import mock
+from urllib.error import HTTPError
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from apub import keys
+
+
+def make_pem():
+    return rsa.generate_private_key(65537, 2048).public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+
+
+@pytest.fixture
+def memory():
+    keys.MEMORY.clear()
+    yield keys.MEMORY
+    keys.MEMORY.clear()
+
+
+def test_get_caches_in_memory(memory):
+    pem = make_pem()
+    mock_get = mock.Mock(return_value={'publicKey': {'publicKeyPem': pem}})
+    with mock.patch('apub.http.get', mock_get):
+        key, cached = keys.get('https://mastodon.local/users/a#main-key')
+        assert not cached
+        again, cached = keys.get('https://mastodon.local/users/a#main-key')
+        assert cached
+        assert again is key
+
+        # a refresh goes back to the network
+        keys.get('https://mastodon.local/users/a#main-key', refresh=True)
+
+    assert mock_get.call_count == 2
+    mock_get.assert_called_with('https://mastodon.local/users/a')
+
+
+def test_get_remembers_gone_actors(memory):
+    mock_get = mock.Mock(side_effect=HTTPError(
+        'https://mastodon.local/users/b', 410, 'Gone', {}, None
+    ))
+    with mock.patch('apub.http.get', mock_get):
+        for _ in range(2):
+            with pytest.raises(keys.ActorGone):
+                keys.get('https://mastodon.local/users/b#main-key')
+
+    mock_get.assert_called_once()
+
+
+def test_get_uses_state_table(memory):
+    pem = make_pem()
+    with mock.patch('dynamo.get_state', return_value={'pem': pem}), \
+         mock.patch('apub.http.get') as mock_get:
+        key, cached = keys.get('https://mastodon.local/users/c#main-key')
+
+    mock_get.assert_not_called()
+    assert cached
+    assert key.public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode() == pem
+
+
+def test_key_miss_skips_cached_actor_documents(memory):
+    from apub import http
+
+    old, new = make_pem(), make_pem()
+    documents = iter([{'publicKey': {'publicKeyPem': pem}}
+                      for pem in (old, new)])
+    with mock.patch('apub.http.get', side_effect=lambda url: next(documents)):
+        # the actor document is cached, e.g. by an earlier Follow
+        http.get_cached('https://mastodon.local/users/a')
+        key, cached = keys.get('https://mastodon.local/users/a#main-key')
+
+    # a key reported as fresh really is
+    assert not cached
+    assert key.public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode() == new
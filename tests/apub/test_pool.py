@@ -0,0 +1,69 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import mock
+from urllib.error import HTTPError
+
+import pytest
+
+from apub import http, pool
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/moved':
+            self.send_response(301)
+            self.send_header('Location', '/actor')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        status = 200 if self.path == '/actor' else 404
+        body = json.dumps({'path': self.path}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_connections_are_reused(server):
+    p = pool.ConnectionPool()
+    for _ in range(3):
+        response = p.request('GET', server + '/actor')
+        assert response.status == 200
+        assert json.loads(response.body) == {'path': '/actor'}
+    assert p.connections_opened == 1
+    p.close()
+
+
+def test_idle_connections_are_evicted(server):
+    p = pool.ConnectionPool(idle_timeout=0.001)
+    p.request('GET', server + '/actor')
+    with mock.patch('time.monotonic', return_value=1e12):
+        p.request('GET', server + '/actor')
+    assert p.connections_opened == 2
+    p.close()
+
+
+def test_get_follows_redirects_and_raises(server):
+    with mock.patch('apub.http.POOL', pool.ConnectionPool()):
+        assert http.get(server + '/moved#main-key') == {'path': '/actor'}
+
+        with pytest.raises(HTTPError) as ex:
+            http.get(server + '/missing')
+        assert ex.value.code == 404
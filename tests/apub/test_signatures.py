@@ -1,10 +1,12 @@
 import os
+import time
 import uuid
 import base64
 import pytest
 import hashlib
 from unittest import mock
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 
@@ -16,6 +18,7 @@ class MockKmsBotoClient:
     def __init__(self):
         self.key_id = str(uuid.uuid4())
         self.private_key = rsa.generate_private_key(65537, 2048)
+        self.data_keys = {}
 
     @property
     def pubkey_pem(self):
@@ -49,6 +52,18 @@ class MockKmsBotoClient:
             )
         }
 
+    def generate_data_key(self, KeyId=None, KeySpec=None):
+        assert KeySpec == 'AES_256'
+        plaintext = os.urandom(32)
+        self.data_keys[KeyId.encode() + plaintext] = plaintext
+        return {
+            'Plaintext': plaintext,
+            'CiphertextBlob': KeyId.encode() + plaintext,
+        }
+
+    def decrypt(self, CiphertextBlob=None):
+        return {'Plaintext': self.data_keys[CiphertextBlob]}
+
 
 @pytest.fixture(scope='module')
 def mock_kms():
@@ -171,3 +186,107 @@ def test_wrapped_verify_headers():
         )
 
         assert ev['actor'] == 'https://mastodon.local/users/mock'
+
+
+def test_local_signer(mock_kms):
+    private_key = rsa.generate_private_key(65537, 2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    sealed_key, data_key = signatures.seal_private_key(pem, 'wrapping-key')
+    assert pem not in base64.b64decode(sealed_key)
+
+    signer = signatures.LocalSigner(sealed_key, data_key)
+    assert signer.public_key_pem() == private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+
+    # signatures must verify against the advertised public key
+    private_key.public_key().verify(
+        signer.sign(b'hello world'),
+        b'hello world',
+        padding.PKCS1v15(),
+        hashes.SHA256()
+    )
+
+
+def test_signer_is_created_once():
+    created = []
+
+    def slow_signer():
+        created.append(1)
+        time.sleep(0.05)
+        return object()
+
+    with mock.patch.object(signatures, '_signer', None), \
+            mock.patch.dict(signatures.SIGNERS,
+                            {config.SIGNING_BACKEND: slow_signer}):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            signers = set(pool.map(lambda _: signatures.get_signer(),
+                                   range(8)))
+
+    assert len(created) == 1
+    assert len(signers) == 1
+
+
+def test_verify_headers_refetches_rotated_key(mock_kms):
+    # cache a stale key for the actor, as if they had since rotated it
+    stale = rsa.generate_private_key(65537, 2048).public_key()
+    signatures.keys.MEMORY.set('https://sns-to-ap.local/users/rotated', stale)
+
+    now_str = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
+    message = f"""(request-target): post /test
+date: {now_str}""".encode()
+    sig = mock_kms.sign(
+        KeyId=mock_kms.key_id,
+        Message=message,
+        MessageType='RAW',
+        SigningAlgorithm='RSASSA_PKCS1_V1_5_SHA_256'
+    )['Signature']
+    headers = {
+        'signature': (
+            f'keyId="https://sns-to-ap.local/users/rotated#main-key",'
+            f'headers="(request-target) date",'
+            f'signature="{base64.b64encode(sig).decode()}"'
+        ),
+        'date': now_str,
+    }
+
+    mock_get = mock.Mock(return_value={
+        'publicKey': {'publicKeyPem': mock_kms.pubkey_pem}
+    })
+    with mock.patch('apub.http.get', mock_get):
+        actor = signatures.verify_headers(headers, '/test')
+
+    assert actor == 'https://sns-to-ap.local/users/rotated'
+    mock_get.assert_called_once()
+
+
+def test_precheck():
+    now_str = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
+    headers = {
+        'signature': ('keyId="https://mastodon.local/users/mock#main-key",'
+                      'headers="(request-target) host date digest",'
+                      'signature="c2lnbmF0dXJl"'),
+        'date': now_str,
+        'digest': signatures.body_digest('{"type": "Follow"}'),
+    }
+    assert signatures.precheck(headers, '{"type": "Follow"}') == \
+        'https://mastodon.local/users/mock#main-key'
+
+    # the body was changed after signing
+    with pytest.raises(signatures.InvalidSignature):
+        signatures.precheck(headers, '{"type": "Undo"}')
+
+    # a replayed request
+    with pytest.raises(signatures.InvalidSignature):
+        signatures.precheck(dict(headers, date='Wed, 04 Oct 2023 21:41:53 GMT'),
+                            '{"type": "Follow"}')
+
+    # a signed digest that isn't there
+    del headers['digest']
+    with pytest.raises(signatures.InvalidSignature):
+        signatures.precheck(headers, '{"type": "Follow"}')
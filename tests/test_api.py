@@ -0,0 +1,218 @@
+import json
+from unittest import mock
+
+import api
+
+
+def make_event(path, headers=None, query=None):
+    return {
+        'headers': headers or {},
+        'queryStringParameters': query or {},
+        'requestContext': {'http': {'path': path, 'method': 'GET'}},
+    }
+
+
+def test_actor_doc_is_built_once():
+    api.actor_document.cache_clear()
+    get_public_key = mock.Mock(return_value='-----BEGIN PUBLIC KEY-----')
+    with mock.patch('apub.signatures.get_public_key', get_public_key):
+        first = api.handler(make_event('/users/sns'), None)
+        second = api.handler(make_event('/users/sns'), None)
+
+    get_public_key.assert_called_once()
+    assert first == second
+    assert first['statusCode'] == 200
+    assert first['headers']['Cache-Control'].startswith('public')
+    body = json.loads(first['body'])
+    assert body['publicKey']['publicKeyPem'] == '-----BEGIN PUBLIC KEY-----'
+
+    # a revalidation with the ETag gets an empty 304
+    revalidated = api.handler(make_event('/users/sns', headers={
+        'if-none-match': first['headers']['ETag']
+    }), None)
+    assert revalidated['statusCode'] == 304
+    assert revalidated['body'] == ''
+    api.actor_document.cache_clear()
+
+
+def test_webfinger():
+    response = api.handler(make_event('/.well-known/webfinger', query={
+        'resource': 'acct:sns@sns-to-ap.local'
+    }), None)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['links'][0]['href'] == \
+        'https://sns-to-ap.local/users/sns'
+
+    response = api.handler(make_event('/.well-known/webfinger', query={
+        'resource': 'acct:someone@sns-to-ap.local'
+    }), None)
+    assert response['statusCode'] == 404
+
+
+def inbox_event(body, headers=None):
+    return {
+        'body': body,
+        'headers': headers or {},
+        'queryStringParameters': {},
+        'requestContext': {'http': {'path': '/users/sns/inbox',
+                                    'method': 'POST'}},
+    }
+
+
+def test_deferred_inbox():
+    body = json.dumps({'id': 'https://mastodon.local/users/mock#follows/1',
+                       'type': 'Follow'})
+    headers = {'signature': 'keyId="https://mastodon.local/users/mock"'}
+    sqs = mock.Mock()
+    with mock.patch('api.sqs', sqs), \
+         mock.patch('config.INBOX_MODE', 'defer'), \
+         mock.patch.dict('os.environ', {'INCOMING_QUEUE': 'incoming'}), \
+         mock.patch('apub.signatures.precheck') as precheck, \
+         mock.patch('apub.signatures.verify_headers') as verify_headers:
+        response = api.handler(inbox_event(body, headers), None)
+        assert response['statusCode'] == 202
+        precheck.assert_called_once_with(headers, body)
+        verify_headers.assert_not_called()
+        queued = json.loads(sqs.send_message.call_args.kwargs['MessageBody'])
+        assert queued == {'signed_request': {
+            'headers': headers, 'method': 'post', 'path': '/users/sns/inbox',
+            'body': body,
+        }}
+
+        # requests failing the cheap checks are still refused up front
+        precheck.side_effect = api.apub.signatures.InvalidSignature('old')
+        response = api.handler(inbox_event(body, headers), None)
+        assert response['statusCode'] == 403
+
+        with mock.patch('config.INBOX_MAX_BYTES', 10):
+            response = api.handler(inbox_event(body, headers), None)
+        assert response['statusCode'] == 413
+
+        # a body under the limit can still make too big a message
+        precheck.side_effect = None
+        big = json.dumps({'content': '"' * 1000})
+        with mock.patch('config.INBOX_MAX_BYTES', len(big) + 100):
+            response = api.handler(inbox_event(big, headers), None)
+        assert response['statusCode'] == 413
+
+    sqs.send_message.assert_called_once()
+
+
+def test_followers_collection():
+    pages = {
+        None: ([{'id': 'f1', 'actor_id': 'https://a.local/users/a'},
+                {'id': 'f2', 'actor_id': 'https://b.local/users/b'}], 'f2'),
+        'f2': ([{'id': 'f3', 'actor_id': 'https://c.local/users/c'}], None),
+    }
+    with mock.patch('followers.count', return_value=3), \
+         mock.patch('dynamo.page',
+                    side_effect=lambda limit, start, attributes: pages[start]):
+        response = api.handler(make_event('/users/sns/followers'), None)
+        assert response['headers']['Cache-Control'] == 'public, max-age=300'
+        collection = json.loads(response['body'])
+        assert collection['type'] == 'OrderedCollection'
+        assert collection['totalItems'] == 3
+
+        first = api.handler(make_event('/users/sns/followers',
+                                       query={'page': 'true'}), None)
+        first = json.loads(first['body'])
+        assert first['orderedItems'] == ['https://a.local/users/a',
+                                         'https://b.local/users/b']
+
+        cursor = first['next'].split('cursor=')[1]
+        response = api.handler(make_event('/users/sns/followers', query={
+            'page': 'true', 'cursor': cursor
+        }), None)
+        last = json.loads(response['body'])
+        assert last['id'] == first['next']
+        assert last['orderedItems'] == ['https://c.local/users/c']
+        assert 'next' not in last
+
+        # revalidating an unchanged page is cheap for both ends
+        response = api.handler(make_event('/users/sns/followers', query={
+            'page': 'true', 'cursor': cursor
+        }, headers={'if-none-match': response['headers']['ETag']}), None)
+        assert response['statusCode'] == 304
+
+
+def test_published_posts_can_be_fetched():
+    import os
+    import objects
+    import sender
+
+    state = {}
+    objects.MEMORY.clear()
+    with mock.patch('dynamo.put_state',
+                    side_effect=lambda item: state.update({item['id']: item})), \
+         mock.patch('dynamo.get_state', side_effect=state.get) as get_state, \
+         mock.patch('followers.snapshot', return_value=[]), \
+         mock.patch('queues.delivery_queue', return_value=None):
+        sender.handler({'Records': [{'Sns': {
+            'MessageId': 'abc-123',
+            'Timestamp': '2023-10-04T21:41:53.000Z',
+            'TopicArn': os.environ['INFO_TOPIC_ARN'],
+            'Message': 'hello world',
+        }}]}, None)
+
+        response = api.handler(make_event('/create/abc-123'), None)
+        assert response['statusCode'] == 200
+        assert response['headers']['Content-Type'] == \
+            'application/activity+json'
+        assert response['headers']['Cache-Control'].endswith('immutable')
+        create = json.loads(response['body'])
+        assert create['id'] == 'https://sns-to-ap.local/create/abc-123'
+        assert create['object']['to'] == 'https://sns-to-ap.local/users/sns/followers'
+
+        response = api.handler(make_event('/abc-123'), None)
+        note = json.loads(response['body'])
+        assert note['@context'] == 'https://www.w3.org/ns/activitystreams'
+        assert note == dict(create['object'], **{'@context': note['@context']})
+
+        assert response['headers']['Last-Modified'] == \
+            'Wed, 04 Oct 2023 21:41:53 GMT'
+        response = api.handler(make_event('/abc-123', headers={
+            'if-modified-since': 'Wed, 04 Oct 2023 21:41:53 GMT'
+        }), None)
+        assert response['statusCode'] == 304
+
+        # both were served from one lookup
+        assert [c.args[0] for c in get_state.call_args_list
+                if c.args[0].startswith('object#')] == ['object#abc-123']
+
+        assert api.handler(make_event('/def-456'), None)['statusCode'] == 404
+        assert api.handler(make_event('/..%2f'), None)['statusCode'] == 404
+    objects.MEMORY.clear()
+
+
+def test_large_responses_are_compressed():
+    import gzip
+    import base64
+
+    page = ([{'id': f'f{i}', 'actor_id': f'https://a.local/users/{i}'}
+             for i in range(50)], None)
+    query = {'page': 'true'}
+    with mock.patch('dynamo.page', return_value=page):
+        plain = api.handler(make_event('/users/sns/followers', query=query),
+                            None)
+        compressed = api.handler(make_event('/users/sns/followers', headers={
+            'accept-encoding': 'gzip, deflate, br'
+        }, query=query), None)
+        revalidated = api.handler(make_event('/users/sns/followers', headers={
+            'accept-encoding': 'gzip',
+            'if-none-match': compressed['headers']['ETag'],
+        }, query=query), None)
+
+    assert 'isBase64Encoded' not in plain
+    assert plain['headers']['Vary'] == 'Accept-Encoding'
+    assert compressed['isBase64Encoded'] is True
+    assert compressed['headers']['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(base64.b64decode(compressed['body'])).decode() == \
+        plain['body']
+    assert len(compressed['body']) < len(plain['body'])
+    assert compressed['headers']['ETag'] == 'W/' + plain['headers']['ETag']
+    assert revalidated['statusCode'] == 304
+    # the 304 repeats the validators the 200 would have been sent with
+    assert revalidated['headers']['ETag'] == compressed['headers']['ETag']
+    assert revalidated['headers']['Vary'] == 'Accept-Encoding'
+    assert 'Content-Encoding' not in revalidated['headers']
+    assert 'isBase64Encoded' not in revalidated
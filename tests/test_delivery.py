@@ -0,0 +1,177 @@
+import os
+import json
+from unittest import mock
+from urllib.error import HTTPError
+
+import pytest
+
+import config
+import dynamo
+import queues
+import sender
+import coalesce
+import delivery
+
+
+FOLLOWERS = [
+    {'actor_id': f'https://{host}.local/users/{i}', 'username': str(i),
+     'inbox': f'https://{host}.local/users/{i}/inbox'}
+    for host in ('up', 'flaky', 'gone')
+    for i in range(3)
+]
+
+
+def sns_event(topic_arn):
+    return {'Records': [{'Sns': {
+        'MessageId': 'abc-123',
+        'Timestamp': '2023-10-04T21:41:53.000Z',
+        'TopicArn': topic_arn,
+        'Message': 'hello world',
+    }}]}
+
+
+def test_queued_delivery_retries_failures():
+    queue = queues.MemoryQueue()
+    attempts = {}
+
+    def mock_post(url, body):
+        attempts[url] = attempts.get(url, 0) + 1
+        if 'gone' in url:
+            raise HTTPError(url, 410, 'Gone', {}, None)
+        if 'flaky' in url and attempts[url] == 1:
+            raise HTTPError(url, 503, 'Unavailable', {}, None)
+        return {}
+
+    with mock.patch('queues.delivery_queue', return_value=queue), \
+         mock.patch('followers.snapshot', return_value=FOLLOWERS), \
+         mock.patch('apub.http.post', mock_post):
+        sender.handler(sns_event(os.environ['ALERT_TOPIC_ARN']), None)
+        assert len(queue) == len(FOLLOWERS)
+        job = json.loads(next(iter(queue.messages.values()))['body'])
+        assert json.loads(job['body'])['object']['to'] == \
+            FOLLOWERS[0]['actor_id']
+
+        handle = lambda event, context: delivery.handler(event, context, queue)
+        assert queue.process(handle) == len(FOLLOWERS)
+
+        # only the flaky inboxes are retried, and only after a backoff
+        assert len(queue) == 3
+        assert queue.process(handle) == 0
+        queue.advance(config.DELIVERY_BACKOFF_BASE)
+        assert queue.process(handle) == 3
+        assert len(queue) == 0
+
+    assert all(n == 1 for url, n in attempts.items() if 'flaky' not in url)
+    assert all(n == 2 for url, n in attempts.items() if 'flaky' in url)
+
+
+def test_handler_gives_up_after_max_attempts():
+    record = {
+        'messageId': 'm1',
+        'body': delivery.job('https://down.local/inbox', b'{}'),
+        'attributes': {
+            'ApproximateReceiveCount': str(config.DELIVERY_MAX_ATTEMPTS)
+        },
+    }
+    with mock.patch('apub.http.post', side_effect=OSError('timed out')):
+        response = delivery.handler({'Records': [record]}, None,
+                                    queues.MemoryQueue())
+    assert response == {'batchItemFailures': []}
+
+
+@pytest.fixture
+def state(fake_dynamo):
+    """The state table, on a clock that a MemoryQueue can move on."""
+    queue = queues.MemoryQueue()
+    with mock.patch('dynamo.time', mock.Mock(time=queue.now)):
+        yield queue
+
+
+def alarm_event(*states):
+    return {'Records': [{'Sns': {
+        'MessageId': f'alarm-{i}',
+        'Timestamp': f'2023-10-04T21:4{i}:00.000Z',
+        'TopicArn': os.environ['ALERT_TOPIC_ARN'],
+        'Message': json.dumps({
+            'AlarmName': 'api-errors', 'NewStateValue': state,
+            'OldStateValue': 'OK' if state == 'ALARM' else 'ALARM',
+            'NewStateReason': f'flap {i}',
+        }),
+    }} for i, state in enumerate(states)]}
+
+
+def test_repeated_alerts_are_coalesced(state):
+    queue = state
+    posted = []
+
+    def mock_post(url, body):
+        posted.append(json.loads(body)['object']['content'])
+        return {}
+
+    handle = lambda event, context: delivery.handler(event, context, queue)
+    with mock.patch('queues.delivery_queue', return_value=queue), \
+         mock.patch('followers.snapshot', return_value=FOLLOWERS[:2]), \
+         mock.patch('apub.http.post', mock_post):
+        sender.handler(alarm_event('ALARM', 'OK', 'ALARM', 'OK'), None)
+
+        # the first alert goes out at once
+        assert queue.process(handle) == 2
+        assert len(posted) == 2 and 'flap 0' in posted[0]
+
+        # the rest when the window closes
+        queue.advance(config.COALESCE_WINDOW)
+        queue.process(handle)
+        assert queue.process(handle) == 2
+        assert len(posted) == 4
+        assert posted[2].startswith('<p>3 more alerts since')
+        assert 'flap 3' in posted[2] and 'In State: OK' in posted[2]
+
+        # and the next burst starts afresh
+        event = alarm_event('ALARM')
+        event['Records'][0]['Sns']['MessageId'] = 'alarm-4'
+        sender.handler(event, None)
+        assert queue.process(handle) == 2
+        assert len(posted) == 6
+
+
+def test_late_flush_leaves_the_next_window_open(state):
+    coalesce.admit('disk 91% full', 't1', state)
+    late = json.loads(next(iter(state.messages.values()))['body'])
+    state.advance(config.COALESCE_WINDOW + 1)
+
+    # the next window opens before the first's flush arrives
+    assert coalesce.admit('disk 92% full', 't2') == (True, None)
+    coalesce.admit('disk 93% full', 't3')
+    assert coalesce.flush(late['flush'], late['first_at']) is None
+    assert 'disk 93% full' in coalesce.flush(late['flush'], 't2')
+
+
+def test_retried_alert_is_sent_again(state):
+    posted = []
+    event = alarm_event('ALARM')
+    with mock.patch('queues.delivery_queue', return_value=None), \
+         mock.patch('followers.snapshot', return_value=FOLLOWERS[:2]), \
+         mock.patch('apub.http.post',
+                    lambda url, body: posted.append(url)):
+        with mock.patch('sender.fan_out', side_effect=OSError('throttled')):
+            with pytest.raises(OSError):
+                sender.handler(event, None)
+
+        # Lambda retries the event: it's the alert that opened the
+        # window, so it isn't held back or counted as a repeat
+        sender.handler(event, None)
+        assert len(posted) == 2
+        window = dynamo.get_state('coalesce#alarm:api-errors')
+        assert window['count'] == 0
+
+        # a real repeat still is
+        sender.handler(alarm_event('OK'), None)
+        assert len(posted) == 2
+
+
+def test_unsettled_alerts_are_sent():
+    with mock.patch('dynamo.take_state', return_value=None), \
+         mock.patch('dynamo.claim_state', return_value=False) as claim, \
+         mock.patch('dynamo.increment_state', return_value=None):
+        assert coalesce.admit('disk 91% full', 't1') == (True, None)
+    assert claim.call_count == coalesce.ATTEMPTS
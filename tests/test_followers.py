@@ -0,0 +1,109 @@
+from unittest import mock
+
+import pytest
+
+import dynamo
+import followers
+
+
+@pytest.fixture
+def mock_dyn(fake_dynamo):
+    fake_dynamo.tables['followers'] = {
+        f'follow-{i}': {'id': {'S': f'follow-{i}'},
+                        'inbox': {'S': f'inbox-{i}'}}
+        for i in range(7)
+    }
+    with mock.patch.object(fake_dynamo, 'scan', wraps=fake_dynamo.scan), \
+         mock.patch('followers._snapshot', None):
+        yield fake_dynamo
+
+
+def scan_calls(client):
+    return [c.kwargs for c in client.scan.call_args_list]
+
+
+def test_list_paginates(mock_dyn):
+    items = list(dynamo.list())
+    assert sorted(i['id'] for i in items) == [f'follow-{i}' for i in range(7)]
+    assert len(scan_calls(mock_dyn)) == 4
+
+
+def test_list_parallel_segments(mock_dyn):
+    items = list(dynamo.list(segments=3))
+    assert sorted(i['id'] for i in items) == [f'follow-{i}' for i in range(7)]
+    assert {scan['Segment'] for scan in scan_calls(mock_dyn)} == {0, 1, 2}
+
+
+def test_snapshot_reused_until_changed(mock_dyn):
+    first = followers.snapshot()
+    scans = len(scan_calls(mock_dyn))
+    assert len(first) == 7
+
+    assert followers.snapshot() is first
+    assert len(scan_calls(mock_dyn)) == scans
+
+    followers.changed()
+    assert followers.snapshot() is not first
+    assert len(scan_calls(mock_dyn)) > scans
+
+
+def test_count_is_kept_running(mock_dyn):
+    assert followers.count() == 7
+    scans = len(scan_calls(mock_dyn))
+
+    followers.changed(added=1)
+    followers.changed(added=-1)
+    followers.changed(added=-1)
+    followers.changed()
+    assert followers.count() == 6
+    assert len(scan_calls(mock_dyn)) == scans
+
+
+def follower(follow_id, actor_id):
+    return {'id': {'S': follow_id}, 'actor_id': {'S': actor_id},
+            'inbox': {'S': actor_id + '/inbox'}}
+
+
+@pytest.fixture
+def legacy(fake_dynamo):
+    a, b = 'https://a.local/users/a', 'https://b.local/users/b'
+    fake_dynamo.tables['followers'] = {item['id']['S']: item for item in [
+        follower(f'{a}#follows/1', a),
+        follower(f'{a}#follows/2', a),
+        follower(f'{b}#follows/1', b),
+        dict(follower(b, b), follow_id={'S': f'{b}#follows/3'}),
+    ]}
+    with mock.patch('followers._snapshot', None):
+        yield fake_dynamo
+
+
+def test_migrate_rekeys_and_dedupes(legacy):
+    a, b = 'https://a.local/users/a', 'https://b.local/users/b'
+    with mock.patch('followers.changed') as changed:
+        batches = [*followers.migrate(batch_size=2)]
+        assert [*followers.migrate(batch_size=2)] == [(2, 0, 0)]
+
+    assert sum(rekeyed for _, rekeyed, _ in batches) == 1
+    assert sum(duplicates for _, _, duplicates in batches) == 2
+    table = legacy.tables['followers']
+    assert sorted(table) == [a, b]
+    assert table[a]['follow_id']['S'].startswith(f'{a}#follows/')
+    # the follower who had already been rekeyed is left as it was
+    assert table[b]['follow_id'] == {'S': f'{b}#follows/3'}
+    assert [followers.actor_for(f'{actor}#follows/{n}')
+            for actor, n in ((a, 1), (a, 2), (b, 1))] == [a, a, b]
+    assert followers.count() == 2
+    changed.assert_called_once()
+
+
+def test_undo_of_a_merged_follow(legacy):
+    import incoming
+
+    a = 'https://a.local/users/a'
+    [*followers.migrate(batch_size=2)]
+    kept = legacy.tables['followers'][a]['follow_id']['S']
+    merged = ({f'{a}#follows/1', f'{a}#follows/2'} - {kept}).pop()
+
+    incoming.apply({'type': 'Undo', 'actor': a, 'object': merged}, {})
+    assert a not in legacy.tables['followers']
+    assert followers.count() == 1
@@ -0,0 +1,43 @@
+import json
+from unittest import mock
+
+import pytest
+
+import formatters
+
+
+@pytest.mark.parametrize('message', [
+    'hello world',
+    'Deploy of api finished in 42s.',
+    'Backup complete\nsee https://example.com/backups?id=1&x=2',
+    'First paragraph.\n\nSecond one, with a link https://example.com/',
+    "It's done; 100% of items processed: ok",
+])
+def test_plain_text_matches_markdown(message):
+    with mock.patch('formatters.render_markdown') as render:
+        fast = formatters.format_message(message)
+    render.assert_not_called()
+
+    expected = formatters.render_markdown(
+        formatters.URL.sub(r'[\1](\1)', message)
+    )
+    assert fast == expected
+
+
+def test_markup_uses_markdown():
+    assert formatters.format_message('# Heading') == '<h1>Heading</h1>'
+    assert formatters.format_message('- a\n- b') == \
+        '<ul>\n<li>a</li>\n<li>b</li>\n</ul>'
+
+
+def test_message_is_parsed_once():
+    message = json.dumps({'source': 'aws.ec2', 'detail-type': 'x',
+                          'detail': {}})
+    with mock.patch('json.loads', wraps=json.loads) as loads:
+        formatters.format_message(message)
+    loads.assert_called_once()
+
+
+def test_unrecognized_json_is_text():
+    assert formatters.format_message('{"hello": 1}') == \
+        '<p>{"hello": 1}</p>'
@@ -0,0 +1,22 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+LAMBDAS = os.path.join(os.path.dirname(__file__), '..', 'lambdas')
+
+HEAVY = ['boto3', 'cryptography', 'markdown']
+
+
+@pytest.mark.parametrize('handler', ['api', 'sender', 'incoming', 'delivery'])
+def test_handlers_import_lightly(handler):
+    # heavy dependencies should only load on first use, not at import
+    output = subprocess.run([
+        sys.executable, '-c',
+        f'import sys, json, {handler}; '
+        f'print(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))'
+    ], cwd=LAMBDAS, env=os.environ, check=True, capture_output=True,
+        text=True).stdout
+    assert json.loads(output) == []
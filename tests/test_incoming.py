@@ -0,0 +1,195 @@
+import json
+import threading
+from unittest import mock
+
+import pytest
+
+import config
+import incoming
+import apub.signatures
+
+
+def record(n, activity, receive_count=1):
+    return {
+        'messageId': f'message-{n}',
+        'attributes': {'ApproximateReceiveCount': str(receive_count)},
+        'body': json.dumps(dict(
+            {'@context': 'https://www.w3.org/ns/activitystreams'}, **activity
+        )),
+    }
+
+
+def follow(actor, n):
+    return {'id': f'{actor}#follows/{n}', 'type': 'Follow', 'actor': actor,
+            'object': config.ACTOR}
+
+
+def undo(actor, n):
+    return {'id': f'{actor}#undo/{n}', 'type': 'Undo', 'actor': actor,
+            'object': follow(actor, n)}
+
+
+def actor_doc(url):
+    return {'id': url, 'preferredUsername': url.rsplit('/', 1)[-1],
+            'inbox': url + '/inbox'}
+
+
+@pytest.fixture
+def store():
+    events = []
+    follows = {}
+    lock = threading.Lock()
+
+    def put(item, unless_same=()):
+        assert item['id'] == item['actor_id']
+        with lock:
+            follows[item['id']] = item['follow_id']
+            events.append(('put', item['follow_id']))
+        return True
+
+    def delete(id, only_if=None):
+        with lock:
+            if id not in follows or \
+                    only_if and only_if != {'follow_id': follows[id]}:
+                return False
+            del follows[id]
+            events.append(('delete', id))
+        return True
+
+    with mock.patch('dynamo.put', put), \
+         mock.patch('dynamo.delete', delete), \
+         mock.patch('followers.changed'), \
+         mock.patch('apub.http.post'), \
+         mock.patch('config.FOLLOWERS', ['a@a.local', 'b@b.local'],
+                    create=True):
+        incoming.processed.RECENT.clear()
+        yield events
+
+
+def test_batch_keeps_per_actor_order(store):
+    a, b = 'https://a.local/users/a', 'https://b.local/users/b'
+    event = {'Records': [
+        record(1, follow(a, 1)),
+        record(2, follow(b, 2)),
+        record(3, undo(a, 1)),
+        record(4, follow(a, 3)),
+    ]}
+    with mock.patch('apub.http.get', side_effect=actor_doc) as get:
+        response = incoming.handler(event, None)
+
+    assert response == {'batchItemFailures': []}
+    a_events = [e for e in store if 'a.local' in e[1]]
+    assert a_events == [('put', f'{a}#follows/1'), ('delete', a),
+                        ('put', f'{a}#follows/3')]
+    # both of a's follows were served by one actor fetch
+    assert sorted(c.args[0] for c in get.call_args_list) == [a, b]
+
+
+def test_failure_holds_back_later_records_from_same_actor(store):
+    a, b = 'https://a.local/users/a', 'https://b.local/users/b'
+    event = {'Records': [
+        record(1, follow(a, 1)),
+        record(2, undo(a, 1)),
+        record(3, follow(b, 2)),
+    ]}
+
+    def get(url):
+        if url == a:
+            raise OSError('timed out')
+        return actor_doc(url)
+
+    with mock.patch('apub.http.get', side_effect=get):
+        response = incoming.handler(event, None)
+
+    assert sorted(f['itemIdentifier'] for f in response['batchItemFailures']) \
+        == ['message-1', 'message-2']
+    assert store == [('put', f'{b}#follows/2')]
+
+
+def signed(n, activity, receive_count=1):
+    queued = record(n, activity, receive_count)
+    queued['body'] = json.dumps({'signed_request': {
+        'headers': {'signature': f'keyId="{activity["actor"]}#main-key",'
+                                 'headers="(request-target)"'},
+        'method': 'post',
+        'path': '/users/sns/inbox',
+        'body': queued['body'],
+    }})
+    return queued
+
+
+def test_deferred_signatures_are_verified(store):
+    a, b, c = ('https://a.local/users/a', 'https://b.local/users/b',
+               'https://c.local/users/c')
+    event = {'Records': [
+        signed(1, follow(a, 1)),
+        signed(2, follow(b, 2)),
+        signed(3, follow(c, 3)),
+    ]}
+
+    def verify_headers(headers, path, method, digest):
+        key_id = apub.signatures.parse_signature(headers)['keyId']
+        if key_id.startswith(b):
+            raise apub.signatures.InvalidSignature('signature does not match')
+        if key_id.startswith(c):
+            raise apub.signatures.KeyFetchFailed('failed getting remote pubkey')
+        return key_id.split('#')[0]
+
+    with mock.patch('apub.signatures.verify_headers', verify_headers), \
+         mock.patch('apub.keys.get') as get_key, \
+         mock.patch('apub.http.get', side_effect=actor_doc):
+        response = incoming.handler(event, None)
+
+    # keys were fetched up front, once each
+    assert sorted(c.args[0] for c in get_key.call_args_list) == \
+        [f'{a}#main-key', f'{b}#main-key', f'{c}#main-key']
+    # b's forgery is dropped, c's is retried once its key can be fetched
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-3'}]}
+    assert store == [('put', f'{a}#follows/1')]
+
+
+def test_redelivered_activity_is_handled_once(store):
+    a = 'https://a.local/users/a'
+    event = {'Records': [record(1, follow(a, 1)), record(2, follow(a, 1))]}
+    with mock.patch('apub.http.get', side_effect=actor_doc) as get:
+        response = incoming.handler(event, None)
+        assert response == {'batchItemFailures': []}
+        response = incoming.handler({'Records': [record(3, follow(a, 1))]},
+                                    None)
+
+    assert response == {'batchItemFailures': []}
+    assert store == [('put', f'{a}#follows/1')]
+    get.assert_called_once()
+
+
+def test_undo_naming_only_the_follow(store):
+    a = 'https://a.local/users/a'
+    undo_by_id = dict(undo(a, 1), object=f'{a}#follows/1')
+    other = dict(undo(a, 2), object=f'{a}#likes/2')
+    event = {'Records': [record(0, follow(a, 1)), record(1, undo_by_id),
+                         record(2, other)]}
+
+    with mock.patch('followers.actor_for',
+                    side_effect=lambda id: a if 'follows' in id else None), \
+         mock.patch('apub.http.get', side_effect=actor_doc):
+        response = incoming.handler(event, None)
+
+    assert response == {'batchItemFailures': []}
+    assert store == [('put', f'{a}#follows/1'), ('delete', a)]
+
+
+def test_late_undo_leaves_a_newer_follow(store):
+    a = 'https://a.local/users/a'
+    late = dict(undo(a, 1), id=f'{a}#undos/1/again')
+    event = {'Records': [record(1, follow(a, 1)), record(2, undo(a, 1)),
+                         record(3, follow(a, 2)), record(4, late)]}
+
+    with mock.patch('apub.http.get', side_effect=actor_doc), \
+         mock.patch('followers.changed') as changed:
+        response = incoming.handler(event, None)
+
+    assert response == {'batchItemFailures': []}
+    assert store == [('put', f'{a}#follows/1'), ('delete', a),
+                     ('put', f'{a}#follows/2')]
+    # the late Undo removed nothing, so followers weren't marked changed
+    assert [c.kwargs['added'] for c in changed.call_args_list] == [1, -1, 1]
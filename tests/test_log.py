@@ -0,0 +1,46 @@
+import logging
+from unittest import mock
+
+import pytest
+
+import log
+
+
+@pytest.fixture
+def records():
+    captured = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            captured.append(record.getMessage())
+
+    handler = Capture()
+    root = logging.getLogger(log.ROOT)
+    root.addHandler(handler)
+    yield captured
+    root.removeHandler(handler)
+    log.configure({})
+    for name in ('test.sampled', 'test.lazy'):
+        logging.getLogger(f'{log.ROOT}.{name}').filters.clear()
+        logging.getLogger(f'{log.ROOT}.{name}').setLevel(logging.NOTSET)
+
+
+def test_payloads_are_not_serialized_unless_emitted(records):
+    logger = log.get('test.lazy')
+    with mock.patch('json.dumps') as dumps:
+        logger.debug('body: %s', log.Payload({'a': 1}))
+    dumps.assert_not_called()
+    assert records == []
+
+    log.configure({'LOG_LEVELS': 'test.lazy=DEBUG'})
+    logger.debug('headers: %s', log.Payload({'Signature': 'secret'}))
+    assert records == ['headers: {"Signature": "[redacted]"}']
+
+
+def test_sampling_keeps_warnings(records):
+    log.configure({'LOG_SAMPLE': 'test.sampled=0'})
+    logger = log.get('test.sampled')
+    for _ in range(10):
+        logger.info('routine')
+    logger.warning('important')
+    assert records == ['important']
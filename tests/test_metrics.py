@@ -0,0 +1,59 @@
+import json
+
+import metrics
+
+
+def test_instrument_emits_one_emf_record(capsys):
+    @metrics.instrument('test')
+    def handler(event, context):
+        for ms in (10, 20, 30):
+            metrics.record('post', ms, host='a.local')
+        metrics.host_failure('b.local')
+        metrics.count('delivered', 3)
+
+    handler({}, None)
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert len(lines) == 1
+    doc = json.loads(lines[0])
+
+    assert doc['Function'] == 'test'
+    assert doc['post.count'] == 3
+    assert doc['post.p50'] == 20
+    assert doc['post.p99'] == 30
+    assert doc['delivered'] == 3
+    assert doc['host_failures'] == 1
+    assert doc['hosts']['a.local'] == {'requests': 3, 'failures': 0,
+                                       'p50': 20}
+
+    directive = doc['_aws']['CloudWatchMetrics'][0]
+    names = {m['Name'] for m in directive['Metrics']}
+    assert {'post.p50', 'post.p99', 'delivered', 'invocation.p50'} <= names
+    assert all(name in doc for name in names)
+
+
+def test_instrument_resets_between_invocations(capsys):
+    @metrics.instrument('test')
+    def handler(event, context):
+        metrics.count('things')
+
+    handler({}, None)
+    handler({}, None)
+    last = capsys.readouterr().out.strip().splitlines()[-1]
+    assert json.loads(last)['things'] == 1
+
+
+def test_hosts_listed_are_capped():
+    from unittest import mock
+
+    metrics.reset()
+    for n in range(100):
+        metrics.record('post', 10, host=f'{n}.local')
+    metrics.host_failure('down.local')
+    with mock.patch('metrics.MAX_HOSTS', 3):
+        doc = metrics.emf('test')
+    metrics.reset()
+
+    assert len(doc['hosts']) == 3
+    assert 'down.local' in doc['hosts']
+    assert doc['hosts_omitted'] == 101 - 3
+    assert doc['host_failures'] == 1
@@ -0,0 +1,47 @@
+import time
+from unittest import mock
+
+import pytest
+
+import processed
+
+
+@pytest.fixture
+def table(fake_dynamo):
+    processed.RECENT.clear()
+    yield fake_dynamo
+    processed.RECENT.clear()
+
+
+def calls(client):
+    return sum(client.calls.values())
+
+
+def test_duplicates_are_claimed_once(table):
+    assert processed.claim('https://a.local/1')
+    processed.done('https://a.local/1')
+    made = calls(table)
+
+    # seen by this container - dropped without asking DynamoDB
+    assert not processed.claim('https://a.local/1')
+    assert calls(table) == made
+
+    # seen by another container
+    processed.RECENT.clear()
+    assert not processed.claim('https://a.local/1')
+    item = table.tables['state']['processed#https://a.local/1']
+    assert item['status'] == {'S': 'done'}
+    assert int(item['expires']['N']) > time.time() + 86400
+
+
+def test_failed_activities_can_be_retried(table):
+    assert processed.claim('https://a.local/2')
+    processed.release('https://a.local/2')
+    assert processed.claim('https://a.local/2')
+
+
+def test_abandoned_claims_lapse(table):
+    with mock.patch('config.PROCESSED_LEASE', -1):
+        assert processed.claim('https://a.local/3')
+    processed.RECENT.clear()
+    assert processed.claim('https://a.local/3')
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import threading
+from unittest import mock
+
+import config
+import sender
+
+
+FOLLOWERS = [
+    {'actor_id': f'https://host{i}.local/users/{i}', 'username': str(i),
+     'inbox': f'https://host{i}.local/users/{i}/inbox'}
+    for i in range(9)
+]
+
+
+class Context:
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123:function:sender'
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def get_remaining_time_in_millis(self):
+        return self.seconds * 1000
+
+
+def test_fan_out_resumes_where_it_left_off():
+    state = {}
+    lock = threading.Lock()
+    posts = []
+
+    def add_to_state_set(id, name, values, ttl):
+        with lock:
+            state.setdefault(id, {name: set()})[name].update(values)
+
+    def post(url, body):
+        time.sleep(0.05)
+        with lock:
+            posts.append(url)
+
+    event = {'Records': [{'Sns': {
+        'MessageId': 'abc-123',
+        'Timestamp': '2023-10-04T21:41:53.000Z',
+        'TopicArn': os.environ['ALERT_TOPIC_ARN'],
+        'Message': 'hello world',
+    }}]}
+    lambda_ = mock.Mock()
+    with mock.patch('dynamo.get_state', side_effect=state.get), \
+         mock.patch('dynamo.add_to_state_set', add_to_state_set), \
+         mock.patch('followers.snapshot', return_value=FOLLOWERS), \
+         mock.patch('queues.delivery_queue', return_value=None), \
+         mock.patch('apub.http.post', post), \
+         mock.patch('sender.lambda_', lambda_), \
+         mock.patch('config.FANOUT_CHECKPOINT_EVERY', 3):
+        # only time enough for the first checkpoint
+        first = sender.handler(event, Context(config.DEADLINE_MARGIN + 0.025))
+        assert len(first) == 3
+        assert len(state['fanout#abc-123']['inboxes']) == 3
+
+        invoke = lambda_.invoke.call_args.kwargs
+        assert invoke['FunctionName'] == Context.invoked_function_arn
+        assert invoke['InvocationType'] == 'Event'
+        continuation = json.loads(invoke['Payload'])
+        assert continuation == dict(event, continuation=1, coalesced=True)
+
+        rest = sender.handler(continuation, Context(60))
+        assert len(rest) == 6
+
+    assert sorted(posts) == sorted(f['inbox'] for f in FOLLOWERS)
+    lambda_.invoke.assert_called_once()
+
+
+def test_short_timeout_still_delivers():
+    posts = []
+    event = {'Records': [{'Sns': {
+        'MessageId': 'abc-123',
+        'Timestamp': '2023-10-04T21:41:53.000Z',
+        'TopicArn': os.environ['ALERT_TOPIC_ARN'],
+        'Message': 'hello world',
+    }}]}
+    lambda_ = mock.Mock()
+    with mock.patch('dynamo.get_state', return_value=None), \
+         mock.patch('dynamo.add_to_state_set'), \
+         mock.patch('followers.snapshot', return_value=FOLLOWERS), \
+         mock.patch('queues.delivery_queue', return_value=None), \
+         mock.patch('apub.http.post', lambda url, body: posts.append(url)), \
+         mock.patch('sender.lambda_', lambda_):
+        # SAM's default 3 second timeout, well under FANOUT_RESERVE
+        sender.handler(event, Context(3))
+
+    assert len(posts) == len(FOLLOWERS)
+    lambda_.invoke.assert_not_called()
+
+
+def test_info_post_is_stored_as_sent():
+    stored, sent = [], []
+    event = {'Records': [{'Sns': {
+        'MessageId': 'abc-123',
+        'Timestamp': '2023-10-04T21:41:53.000Z',
+        'TopicArn': os.environ['INFO_TOPIC_ARN'],
+        'Message': 'hello world',
+    }}]}
+    with mock.patch('dynamo.get_state', return_value=None), \
+         mock.patch('dynamo.add_to_state_set'), \
+         mock.patch('followers.snapshot', return_value=FOLLOWERS), \
+         mock.patch('queues.delivery_queue', return_value=None), \
+         mock.patch('apub.http.post',
+                    lambda url, body: sent.append(body)), \
+         mock.patch('objects.store',
+                    lambda id, payload: stored.append(payload)), \
+         mock.patch('apub.prepared.PreparedActivity.render',
+                    autospec=True,
+                    side_effect=lambda self, **fields: b'{"rendered": 1}'
+                    ) as render:
+        sender.handler(event, None)
+
+    render.assert_called_once()
+    assert len(sent) == len(FOLLOWERS)
+    assert all(payload is stored[0] for payload in sent)